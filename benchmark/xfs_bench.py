@@ -0,0 +1,491 @@
+# coding:utf-8
+"""Reproducible benchmarks for xfs_scan, xfs_file and xfs_rescue.
+
+A synthetic device is an image file plus a recording of xfs_db output
+(IMAGE.xfs_db.json) for `sb`, `inode ... print`, `ls` and `bmap`. The
+recording is replayed either in-process (backend `stub`, no subprocess
+overhead, measures parsing and traversal) or by the fake executable in
+bin/xfs_db (backend `exec`, measures the real command path). Backend
+`xfs_db` runs the real tool, e.g. against an image created by mkfs.xfs.
+"""
+
+from importlib.machinery import SourceFileLoader
+import importlib.util
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa:E501
+
+from xarg import add_command  # noqa:E402
+from xarg import argp  # noqa:E402
+from xarg import commands  # noqa:E402
+from xarg import run_command  # noqa:E402
+
+from xfs_aid import xfs_aidkit  # noqa:E402
+from xfs_aid.exception import XfsCmdException  # noqa:E402
+from xfs_aid.xfs_debug import xfs_db  # noqa:E402
+
+BINDIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
+RECORDING_ENV: str = "XFS_BENCH_RECORDING"
+BACKENDS: Tuple[str, ...] = ("stub", "exec", "xfs_db")
+CASES: Tuple[str, ...] = ("scan", "raw", "rescue")
+
+
+# replay() of the fake executable, shared by the in-process stub
+def load_stub() -> Any:
+    # bin/xfs_db has no .py suffix, so the loader must be given explicitly
+    path: str = os.path.join(BINDIR, "xfs_db")
+    spec = importlib.util.spec_from_file_location(
+        "xfs_db_stub", path, loader=SourceFileLoader("xfs_db_stub", path))
+    assert spec is not None and spec.loader is not None, path
+    module: Any = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+xfs_db_stub: Any = load_stub()
+
+
+def recording_path(device: str) -> str:
+    return os.environ.get(RECORDING_ENV, f"{device}.xfs_db.json")
+
+
+class xfs_db_replay(xfs_db):
+    """xfs_db backend stub, replays recorded output without subprocess"""
+
+    RECORDINGS: Dict[str, Dict[str, str]] = {}
+
+    def command_bytes(self, *cmds: str) -> bytes:
+        path: str = recording_path(self.device)
+        if path not in self.RECORDINGS:
+            with open(path, "r", encoding="utf-8") as rhdl:
+                self.RECORDINGS[path] = json.load(rhdl)
+        stdout: Optional[str] = xfs_db_stub.replay(self.RECORDINGS[path],
+                                                   list(cmds))
+        if stdout is None:
+            raise XfsCmdException(1, "; ".join(cmds))
+        return os.fsencode(stdout)
+
+
+class xfs_db_recorder(xfs_db):
+    """xfs_db backend that records the output of every command"""
+
+    RECORDING: Dict[str, str] = {}
+
+    def command_bytes(self, *cmds: str) -> bytes:
+        stdout: bytes = super().command_bytes(*cmds)
+        # non UTF-8 bytes are kept as surrogate escapes
+        self.RECORDING["; ".join(cmds)] = os.fsdecode(stdout)
+        return stdout
+
+
+class xfs_synthetic(object):
+    """synthetic XFS tree, rendered as xfs_db output"""
+
+    ROOT_INO: int = 128
+
+    def __init__(self, fanout: int = 4, depth: int = 3, files: int = 16,
+                 extents: int = 1, blocks: int = 4, blocksize: int = 4096,
+                 agblocks: int = 1 << 20, clones: int = 0) -> None:
+        self.__fanout: int = fanout
+        self.__depth: int = depth
+        self.__files: int = files
+        self.__extents: int = max(1, min(extents, blocks))
+        self.__blocks: int = max(1, blocks)
+        self.__clones: int = max(0, clones)
+        self.__blocksize: int = blocksize
+        self.__agblocks: int = agblocks
+        self.__next_ino: int = self.ROOT_INO + 3
+        self.__next_block: int = 64  # skip AG headers
+        self.__recording: Dict[str, str] = {}
+        self.__tree: List[Tuple[str, int]] = []  # (path, size or -1)
+
+    @property
+    def blocksize(self) -> int:
+        return self.__blocksize
+
+    @property
+    def dblocks(self) -> int:
+        """device blocks used"""
+        return self.__next_block
+
+    @property
+    def recording(self) -> Dict[str, str]:
+        return self.__recording
+
+    @property
+    def extents(self) -> int:
+        """extents per file"""
+        return self.__extents
+
+    @property
+    def tree(self) -> List[Tuple[str, int]]:
+        """all paths and file sizes (-1 for directory), parent first"""
+        return self.__tree
+
+    def __alloc_ino(self) -> int:
+        ino: int = self.__next_ino
+        self.__next_ino += 1
+        return ino
+
+    @classmethod
+    def entry(cls, cookie: int, ino: int, filetype: str, name: str) -> str:
+        nlen: int = len(name.encode())
+        hash: int = sum(name.encode()) & 0xffffffff
+        return f"{cookie:<10} {ino:<18} {filetype:<14} 0x{hash:08x} {nlen:>3} {name} (good)"  # noqa:E501
+
+    @classmethod
+    def inode(cls, ino: int, mode: str, size: int, nextents: int) -> str:
+        stamp: int = 1700000000 + ino
+        return "\n".join([
+            "core.magic = 0x494e",
+            f"core.mode = {mode}",
+            "core.version = 3",
+            "core.format = 2 (extents)",
+            "core.nlinkv2 = 1",
+            f"core.uid = {os.getuid()}",
+            f"core.gid = {os.getgid()}",
+            f"core.atime.sec = {time.ctime(stamp)}",
+            "core.atime.nsec = 000000000",
+            f"core.mtime.sec = {time.ctime(stamp)}",
+            "core.mtime.nsec = 000000000",
+            f"core.ctime.sec = {time.ctime(stamp)}",
+            "core.ctime.nsec = 000000000",
+            f"core.size = {size}",
+            f"core.nblocks = {nextents}",
+            f"core.nextents = {nextents}",
+            f"v3.inumber = {ino}",
+        ]) + "\n"
+
+    def __file(self, ino: int, source: Optional[Tuple[int, str]] = None
+               ) -> Tuple[int, str]:
+        """size and bmap of a new file, or share the extents of source"""
+        if source is not None:  # reflink clone
+            size, bmap = source
+            self.__recording[f"inode {ino}; print"] =\
+                self.inode(ino, "0100644", size, bmap.count("\n"))
+            self.__recording[f"inode {ino}; bmap"] = bmap
+            return source
+        blocks: int = self.__blocks
+        size: int = blocks * self.blocksize - ino % self.blocksize
+        extents: List[str] = []
+        offset: int = 0
+        for index in range(self.__extents):
+            count: int = blocks // self.__extents +\
+                (1 if index < blocks % self.__extents else 0)
+            start: int = self.__next_block
+            agno, agbno = divmod(start, self.__agblocks)
+            extents.append(f"data offset {offset} startblock {start} ({agno}/{agbno}) count {count} flag 0")  # noqa:E501
+            offset += count
+            # leave a hole between extents of a fragmented file
+            self.__next_block += count + (1 if self.__extents > 1 else 0)
+        self.__recording[f"inode {ino}; print"] =\
+            self.inode(ino, "0100644", size, len(extents))
+        self.__recording[f"inode {ino}; bmap"] = "\n".join(extents) + "\n"
+        return size, self.__recording[f"inode {ino}; bmap"]
+
+    def __dir(self, path: str, ino: int, parent: int, level: int) -> None:
+        lines: List[str] = [f"{path}:",
+                            self.entry(8, ino, "directory", "."),
+                            self.entry(10, parent, "directory", "..")]
+        cookie: int = 12
+        children: List[Tuple[str, int]] = []
+        source: Optional[Tuple[int, str]] = None
+        for index in range(self.__files):
+            name: str = f"file{index}"
+            child: int = self.__alloc_ino()
+            if index % (self.__clones + 1) == 0:
+                source = None
+            source = self.__file(child, source)
+            size: int = source[0]
+            lines.append(self.entry(cookie, child, "regular", name))
+            self.__tree.append((os.path.join(path, name), size))
+            cookie += 2
+        if level < self.__depth:
+            for index in range(self.__fanout):
+                name: str = f"dir{index}"
+                child: int = self.__alloc_ino()
+                children.append((name, child))
+                lines.append(self.entry(cookie, child, "directory", name))
+                cookie += 2
+        stdout: str = "\n".join(lines) + "\n"
+        if ino == self.ROOT_INO:
+            self.__recording[f"ls {path}"] = stdout
+        self.__recording[f"inode {ino}; ls"] = stdout
+        self.__recording[f"inode {ino}; print"] =\
+            self.inode(ino, "040755", 6 + 16 * len(lines), 0)
+        for name, child in children:
+            self.__tree.append((os.path.join(path, name), -1))
+            self.__dir(os.path.join(path, name), child, ino, level + 1)
+
+    def build(self) -> "xfs_synthetic":
+        self.__dir("/", self.ROOT_INO, self.ROOT_INO, 0)
+        agcount: int = self.dblocks // self.__agblocks + 1
+        self.__recording["sb 0; print"] = "\n".join([
+            "magicnum = 0x58465342",
+            f"blocksize = {self.blocksize}",
+            f"dblocks = {self.dblocks}",
+            f"agblocks = {self.__agblocks}",
+            f"agcount = {agcount}",
+            f"features_ro_compat = {0x4 if self.__clones else 0x0:#x}",
+        ]) + "\n"
+        return self
+
+    def save(self, image: str) -> None:
+        """write the sparse image file and the xfs_db recording"""
+        with open(image, "wb") as whdl:
+            whdl.truncate(self.dblocks * self.blocksize)
+        with open(f"{image}.xfs_db.json", "w", encoding="utf-8") as whdl:
+            json.dump(self.recording, whdl)
+
+
+def mkfs_image(image: str, tree: xfs_synthetic, size: int) -> bool:
+    """create a real XFS image with the same tree, needs root and mkfs.xfs
+
+    Files of a directory are written round-robin in extent sized chunks
+    and synced after each round to reproduce the requested fragmentation.
+    """
+    if os.geteuid() != 0:
+        return False
+    for tool in ("mkfs.xfs", "mount", "umount"):
+        if shutil.which(tool) is None:
+            return False
+    with open(image, "wb") as whdl:
+        whdl.truncate(size)
+    subprocess.run(["mkfs.xfs", "-q", "-f", image], check=True)
+    mountpoint: str = tempfile.mkdtemp(prefix="xfs-bench-")
+    subprocess.run(["mount", "-o", "loop", image, mountpoint], check=True)
+    try:
+        pending: Dict[str, List[Tuple[str, int]]] = {}
+        for path, length in tree.tree:
+            target: str = os.path.join(mountpoint, path[1:])
+            if length < 0:
+                os.makedirs(target, exist_ok=True)
+            else:
+                dir: str = os.path.dirname(target)
+                pending.setdefault(dir, []).append((target, length))
+        for files in pending.values():
+            handles = [(open(t, "wb"), n) for t, n in files]
+            try:
+                for index in range(tree.extents):
+                    for whdl, length in handles:
+                        chunk: int = -(-length // tree.extents)
+                        data: bytes = os.urandom(max(0, min(chunk, length - index * chunk)))  # noqa:E501
+                        whdl.write(data)
+                        whdl.flush()
+                        os.fsync(whdl.fileno())
+            finally:
+                for whdl, _ in handles:
+                    whdl.close()
+    finally:
+        subprocess.run(["umount", mountpoint], check=True)
+        os.rmdir(mountpoint)
+    return True
+
+
+def bench_scan(device: str, jobs: int, direct: bool) -> Dict[str, int]:
+    files: int = 0
+    entries: int = 0
+    scanner = xfs_aidkit.xfs_scan(device=device, jobs=jobs)
+    for obj in scanner.objects:
+        entries += 1
+        if obj.is_file:
+            files += 1
+    return {"files": files, "entries": entries, "bytes": 0}
+
+
+def bench_raw(device: str, jobs: int, direct: bool) -> Dict[str, int]:
+    files: int = 0
+    nbytes: int = 0
+    with open(os.devnull, "wb") as sink:
+        for obj in xfs_aidkit.xfs_scan(device=device, jobs=jobs).files:
+            xfile = xfs_aidkit.xfs_file(device=device, inode_number=obj.ino,
+                                        direct=direct)
+            xfile.raw(stream=sink)
+            nbytes += xfile.size
+            files += 1
+    return {"files": files, "entries": files, "bytes": nbytes}
+
+
+def bench_rescue(device: str, jobs: int, direct: bool) -> Dict[str, int]:
+    files: int = 0
+    entries: int = 0
+    nbytes: int = 0
+    basedir: str = tempfile.mkdtemp(prefix="xfs-bench-rescue-")
+    try:
+        handler = xfs_aidkit.xfs_rescue(device=device, basedir=basedir,
+                                        jobs=jobs, direct=direct)
+        for xfile in handler.xfiles:
+            if xfile.rebuild():
+                nbytes += xfile.size
+                files += 1
+        for _ in handler.restore():
+            entries += 1
+    finally:
+        shutil.rmtree(basedir, ignore_errors=True)
+    return {"files": files, "entries": entries, "bytes": nbytes}
+
+
+BENCHES: Dict[str, Callable[[str, int, bool], Dict[str, int]]] = {
+    "scan": bench_scan,
+    "raw": bench_raw,
+    "rescue": bench_rescue,
+}
+
+
+def bench_child(queue: Any, case: str, device: str, backend: str,
+                jobs: int, direct: bool) -> None:
+    if backend == "stub":
+        xfs_aidkit.xfs_db = xfs_db_replay  # type: ignore
+    elif backend == "exec":
+        os.environ["PATH"] = os.pathsep.join([BINDIR, os.environ["PATH"]])
+    start: float = time.perf_counter()
+    result: Dict[str, Any] = BENCHES[case](device, jobs, direct)
+    result["seconds"] = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux, for children it is the largest
+    # xfs_db process (backends exec and xfs_db)
+    result["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    result["rss_children"] =\
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    queue.put(result)
+
+
+def bench(case: str, device: str, backend: str, jobs: int = 1,
+          direct: bool = False) -> Dict[str, Any]:
+    """run one case in a fresh process, so peak RSS is per case"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=bench_child,
+                              args=(queue, case, device, backend, jobs,
+                                    direct))
+    process.start()
+    process.join()
+    if queue.empty():
+        raise RuntimeError(f"benchmark {case} exit code {process.exitcode}")
+    return queue.get()
+
+
+def show(case: str, result: Dict[str, Any]) -> str:
+    seconds: float = max(result["seconds"], 1e-9)
+    files: float = result["files"] / seconds
+    entries: float = result["entries"] / seconds
+    mbytes: float = result["bytes"] / seconds / (1 << 20)
+    rss: float = result["rss"] / (1 << 20)
+    children: float = result["rss_children"] / (1 << 20)
+    return f"{case:<8} {seconds:10.3f}s {files:12.1f} files/s {entries:12.1f} entries/s {mbytes:10.1f} MB/s {rss:8.1f} MB peak RSS {children:8.1f} MB xfs_db peak RSS"  # noqa:E501
+
+
+@add_command("generate", help="generate a synthetic device")
+def add_cmd_generate(_arg: argp):
+    _arg.add_argument("--fanout", type=int, default=4, metavar="N",
+                      help="subdirectories per directory")
+    _arg.add_argument("--depth", type=int, default=3, metavar="N",
+                      help="directory tree depth")
+    _arg.add_argument("--files", type=int, default=16, metavar="N",
+                      help="files per directory")
+    _arg.add_argument("--blocks", type=int, default=4, metavar="N",
+                      help="blocks per file")
+    _arg.add_argument("--extents", type=int, default=1, metavar="N",
+                      help="extents per file (fragmentation)")
+    _arg.add_argument("--clones", type=int, default=0, metavar="N",
+                      help="reflink clones sharing the extents of a file")
+    _arg.add_argument("--blocksize", type=int, default=4096, metavar="N",
+                      help="filesystem block size")
+    _arg.add_argument("--mkfs", type=int, default=0, metavar="BYTES",
+                      help="also create a real XFS image of this size")
+
+
+@run_command(add_cmd_generate)
+def run_cmd_generate(cmds: commands) -> int:
+    tree = xfs_synthetic(fanout=cmds.args.fanout, depth=cmds.args.depth,
+                         files=cmds.args.files, extents=cmds.args.extents,
+                         blocks=cmds.args.blocks, clones=cmds.args.clones,
+                         blocksize=cmds.args.blocksize).build()
+    tree.save(image=cmds.args.device)
+    cmds.stdout(f"{cmds.args.device}: {len(tree.tree)} entries {tree.dblocks} blocks")  # noqa:E501
+    if cmds.args.mkfs > 0:
+        image: str = f"{cmds.args.device}.xfs"
+        if mkfs_image(image=image, tree=tree, size=cmds.args.mkfs):
+            cmds.stdout(f"{image}: XFS image")
+        else:
+            cmds.stderr("mkfs.xfs loopback image needs root and xfsprogs")
+    return 0
+
+
+@add_command("record", help="record xfs_db output of a real device")
+def add_cmd_record(_arg: argp):
+    _arg.add_argument("--output", type=str, default=None, metavar="FILE",
+                      help="recording file, default DEV.xfs_db.json")
+
+
+@run_command(add_cmd_record)
+def run_cmd_record(cmds: commands) -> int:
+    xfs_aidkit.xfs_db = xfs_db_recorder  # type: ignore
+    scanner = xfs_aidkit.xfs_scan(device=cmds.args.device)
+    scanner.debug.sb(0)
+    for obj in scanner.objects:
+        scanner.debug.inode(obj.ino)
+    output: str = cmds.args.output or f"{cmds.args.device}.xfs_db.json"
+    with open(output, "w", encoding="utf-8") as whdl:
+        json.dump(xfs_db_recorder.RECORDING, whdl)
+    cmds.stdout(f"{output}: {len(xfs_db_recorder.RECORDING)} commands")
+    return 0
+
+
+@add_command("run", help="run benchmarks")
+def add_cmd_run(_arg: argp):
+    _arg.add_argument("--backend", type=str, default="stub", choices=BACKENDS,
+                      help="xfs_db backend")
+    _arg.add_argument("--case", type=str, nargs="*", default=list(CASES),
+                      choices=CASES, dest="cases", help="benchmark cases")
+    _arg.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                      help="concurrent directory listings")
+    _arg.add_argument("--direct", action="store_true",
+                      help="direct I/O, bypass the page cache")
+
+
+@run_command(add_cmd_run)
+def run_cmd_run(cmds: commands) -> int:
+    for case in cmds.args.cases:
+        result = bench(case=case, device=cmds.args.device,
+                       backend=cmds.args.backend, jobs=cmds.args.jobs,
+                       direct=cmds.args.direct)
+        cmds.stdout(show(case, result))
+    return 0
+
+
+@add_command("xfs-bench", help="benchmark xfs-aid")
+def add_cmd_bench(_arg: argp):
+    _arg.add_argument(dest="device", type=str, metavar="DEV",
+                      help="XFS filesystem device or synthetic image")
+
+
+@run_command(add_cmd_bench, add_cmd_generate, add_cmd_record, add_cmd_run)
+def run_cmd_bench(cmds: commands) -> int:
+    return 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    cmds = commands()
+    return cmds.run(
+        root=add_cmd_bench,
+        argv=argv,
+        description="Benchmark xfs-aid with a synthetic xfs_db stand-in.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
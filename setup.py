@@ -34,4 +34,5 @@ setup(
                   "Bug Tracker": __urlbugs__,
                   "Documentation": __urldocs__},
     packages=find_packages(include=["xfs_aid*"], exclude=["tests"]),
-    install_requires=all_requirements())
+    install_requires=all_requirements(),
+    extras_require={"report": ["numpy"]})
@@ -0,0 +1,59 @@
+# coding:utf-8
+
+import os
+from typing import List
+
+import pytest
+
+from xfs_aid.exception import XfsBmapException
+from xfs_aid.exception import XfsLsException
+from xfs_aid.xfs_debug import xfs_blockmap
+from xfs_aid.xfs_debug import xfs_content
+
+
+def entry(cookie: int, ino: int, filetype: str, name: bytes) -> bytes:
+    return b"%d %d %s 0x00000000 %d %s (good)\n" % (
+        cookie, ino, filetype.encode(), len(name), name)
+
+
+def test_ls_names():
+    names: List[bytes] = [b".", b"..", b"with space", b"caf\xe9",
+                          b"ab\ncd e", b"tail\n12 999 regular 0x0 1 x"]
+    stdout: bytes = b"/dir:\n" + b"".join(
+        entry(index, 128 + index, "regular", name)
+        for index, name in enumerate(names))
+    contents: List[xfs_content] = list(xfs_content.parse("/dir", stdout))
+    assert [content.name_bytes for content in contents] == names
+    assert [content.ino for content in contents] == [128, 129, 130, 131,
+                                                     132, 133]
+    # not valid UTF-8, os.fsencode() gives the raw bytes back
+    assert os.fsencode(contents[3].name) == b"caf\xe9"
+    assert contents[3].path == os.path.join("/dir", os.fsdecode(b"caf\xe9"))
+    assert contents[2].is_file and contents[2].nlen == 10
+
+
+def test_ls_name_cut_off():
+    with pytest.raises(XfsLsException):
+        list(xfs_content.parse("/", b"12 131 regular 0x0 7 ab\n"))
+    with pytest.raises(XfsLsException):
+        xfs_content("/", "12 131 regular 0x0 7 ab")
+
+
+def test_bmap():
+    stdout: bytes = b"data offset 0 startblock 100 (0/100) count 10 flag 0\n"\
+        b"data offset 10 startblock 300 (1/44) count 2 flag 1\n"
+    extents: List[xfs_blockmap] = list(xfs_blockmap.parse(4096, stdout))
+    assert [(e.startoffset, e.startblock, e.agno, e.agbno, e.count, e.flag)
+            for e in extents] == [(0, 100, 0, 100, 10, 0),
+                                  (10, 300, 1, 44, 2, 1)]
+    assert extents[1].endblock == 302 and extents[1].endoffset == 12
+
+
+@pytest.mark.parametrize("stdout", [
+    b"data offset 0 startblock 100 (0/100) count 10 flag 0\nbad line\n",
+    b"no current inode\n",
+    b"garbage data offset 0 startblock 1 (0/1) count 1 flag 0\n",
+])
+def test_bmap_unparsed(stdout: bytes):
+    with pytest.raises(XfsBmapException):
+        list(xfs_blockmap.parse(4096, stdout))
@@ -0,0 +1,60 @@
+# coding:utf-8
+
+import errno
+import os
+import random
+
+import pytest
+
+from xfs_aid.xfs_direct import xfs_buffer_pool
+from xfs_aid.xfs_direct import xfs_direct
+
+ALIGNMENT: int = 1024
+
+
+@pytest.fixture(name="device")
+def fixture_device(tmp_path):
+    data: bytes = random.Random(0).randbytes(64 * ALIGNMENT)
+    path = tmp_path / "device"
+    path.write_bytes(data)
+    return str(path), data
+
+
+def read(reader: xfs_direct, offset: int, length: int) -> bytes:
+    return b"".join(bytes(chunk) for chunk in reader.read(offset, length))
+
+
+def padded(data: bytes, offset: int, length: int) -> bytes:
+    return data[offset:offset + -(-length // ALIGNMENT) * ALIGNMENT]
+
+
+@pytest.mark.parametrize("sector", [None, 512, 4096, 16384])
+def test_read(device, monkeypatch, sector):
+    path, data = device
+    if sector is not None:  # e.g. a 1 KiB block image on a 4Kn disk
+        monkeypatch.setattr(xfs_direct, "sector_size",
+                            classmethod(lambda cls, fd: sector))
+    pool = xfs_buffer_pool(bufsize=16384, maximum=1)
+    with xfs_direct(path, alignment=ALIGNMENT, pool=pool) as reader:
+        for offset, length in [(0, 1), (ALIGNMENT, 3000),
+                               (3 * ALIGNMENT, 40000), (5 * ALIGNMENT, 1),
+                               (63 * ALIGNMENT, ALIGNMENT)]:
+            assert read(reader, offset, length) ==\
+                padded(data, offset, length)
+
+
+def test_read_einval(device, monkeypatch):
+    path, data = device
+    preadv = os.preadv
+
+    def unaligned(fd, buffers, offset):
+        monkeypatch.setattr(os, "preadv", preadv)
+        raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+    with xfs_direct(path, alignment=ALIGNMENT) as reader:
+        if not reader.direct:
+            pytest.skip("O_DIRECT not supported")
+        monkeypatch.setattr(os, "preadv", unaligned)
+        assert read(reader, 2 * ALIGNMENT, 5000) ==\
+            padded(data, 2 * ALIGNMENT, 5000)
+        assert not reader.direct
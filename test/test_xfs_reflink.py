@@ -0,0 +1,127 @@
+# coding:utf-8
+
+import errno
+import os
+import struct
+from typing import Dict
+from typing import Tuple
+
+from xfs_aid import xfs_aidkit
+from xfs_aid.exception import XfsCmdException
+from xfs_aid.xfs_debug import xfs_db
+from xfs_aid.xfs_reflink import copy_range
+from xfs_aid.xfs_reflink import xfs_shared_extents
+
+BLOCKSIZE: int = 512
+
+
+class xfs_db_stub(xfs_db):
+    """xfs_db with canned output"""
+
+    RECORDING: Dict[str, str] = {}
+
+    def command_bytes(self, *cmds: str) -> bytes:
+        stdout = self.RECORDING.get("; ".join(cmds))
+        if stdout is None:
+            raise XfsCmdException(1, "; ".join(cmds))
+        return os.fsencode(stdout)
+
+
+def block(number: int) -> bytes:
+    return struct.pack("<Q", number) * (BLOCKSIZE // 8)
+
+
+def entry(cookie: int, ino: int, filetype: str, name: str) -> str:
+    return f"{cookie} {ino} {filetype} 0x00000000 {len(name)} {name} (good)"
+
+
+def inode(ino: int, size: int) -> str:
+    return "\n".join([
+        "core.mode = 0100644",
+        "core.uid = 0",
+        "core.gid = 0",
+        "core.atime.sec = Tue Nov 14 22:13:20 2023",
+        "core.atime.nsec = 000000000",
+        "core.mtime.sec = Tue Nov 14 22:13:20 2023",
+        "core.mtime.nsec = 000000000",
+        f"core.size = {size}",
+        f"v3.inumber = {ino}",
+    ]) + "\n"
+
+
+def bmap(*extents: Tuple[int, int, int]) -> str:
+    return "".join(f"data offset {offset} startblock {start} (0/{start}) count {count} flag 0\n"  # noqa:E501
+                   for offset, start, count in extents)
+
+
+def test_shared_extents_disjoint():
+    shared = xfs_shared_extents(blocksize=BLOCKSIZE)
+    shared.add(100, 110, "a", 0, 10 * BLOCKSIZE)
+    shared.add(105, 115, "a", 10 * BLOCKSIZE, 10 * BLOCKSIZE)
+    assert list(shared.lookup(100, 115)) == [
+        (100, 110, "a", 0, 10 * BLOCKSIZE),
+        (110, 115, "a", 15 * BLOCKSIZE, 5 * BLOCKSIZE)]
+    assert list(shared.lookup(107, 112)) == [
+        (107, 110, "a", 7 * BLOCKSIZE, 3 * BLOCKSIZE),
+        (110, 112, "a", 15 * BLOCKSIZE, 5 * BLOCKSIZE)]
+
+
+def test_shared_extents_chunks():
+    shared = xfs_shared_extents(blocksize=BLOCKSIZE)
+    chunk: int = 1 << shared.CHUNK_SHIFT
+    shared.add(chunk - 2, 2 * chunk + 2, "a", 0, (chunk + 4) * BLOCKSIZE)
+    shared.add(2 * chunk + 2, 2 * chunk + 3, "b", 0, BLOCKSIZE)
+    assert list(shared.lookup(0, 3 * chunk)) == [
+        (chunk - 2, 2 * chunk + 2, "a", 0, (chunk + 4) * BLOCKSIZE),
+        (2 * chunk + 2, 2 * chunk + 3, "b", 0, BLOCKSIZE)]
+    assert list(shared.lookup(chunk + 1, chunk + 2)) == [
+        (chunk + 1, chunk + 2, "a", 3 * BLOCKSIZE, (chunk + 1) * BLOCKSIZE)]
+
+
+def test_copy_range_fallback(tmp_path, monkeypatch):
+    def unsupported(*args, **kwargs):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    source = tmp_path / "source"
+    source.write_bytes(block(1) + block(2))
+    monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+    with open(source, "rb") as rhdl, open(tmp_path / "target", "wb") as whdl:
+        copy_range(rhdl.fileno(), BLOCKSIZE, BLOCKSIZE, whdl.fileno(), 0)
+    assert (tmp_path / "target").read_bytes() == block(2)
+
+
+def test_rescue_overlapping_shared_extents(tmp_path, monkeypatch):
+    device = tmp_path / "device"
+    device.write_bytes(b"".join(block(number) for number in range(128)))
+    monkeypatch.setattr(xfs_db_stub, "RECORDING", {
+        "sb 0; print": "\n".join([
+            "magicnum = 0x58465342",
+            f"blocksize = {BLOCKSIZE}",
+            "agcount = 1",
+            "agblocks = 128",
+            "features_ro_compat = 0x4",
+        ]) + "\n",
+        "ls /": "\n".join([
+            "/:",
+            entry(8, 128, "directory", "."),
+            entry(10, 128, "directory", ".."),
+            entry(12, 131, "regular", "a"),
+            entry(14, 132, "regular", "b"),
+        ]) + "\n",
+        # a maps blocks 105..109 twice (dedup within a file)
+        "inode 131; print": inode(131, 20 * BLOCKSIZE),
+        "inode 131; bmap": bmap((0, 100, 10), (10, 105, 10)),
+        "inode 132; print": inode(132, 15 * BLOCKSIZE),
+        "inode 132; bmap": bmap((0, 100, 15)),
+    })
+    monkeypatch.setattr(xfs_aidkit, "xfs_db", xfs_db_stub)
+
+    target = tmp_path / "target"
+    handler = xfs_aidkit.xfs_rescue(device=str(device), basedir=str(target))
+    assert all(xfile.rebuild() for xfile in handler.xfiles)
+    assert (target / "a").read_bytes() == b"".join(
+        block(number) for number in [*range(100, 110), *range(105, 115)])
+    assert (target / "b").read_bytes() == b"".join(
+        block(number) for number in range(100, 115))
+    assert handler.shared is not None
+    assert handler.shared.cloned + handler.shared.copied == 15 * BLOCKSIZE
@@ -0,0 +1,78 @@
+# coding:utf-8
+
+import random
+from typing import Any
+from typing import Dict
+
+import pytest
+
+from xfs_aid import xfs_report
+from xfs_aid.xfs_debug import xfs_blockmap
+from xfs_aid.xfs_report import xfs_extent_columns
+from xfs_aid.xfs_report import xfs_extent_report
+
+AGCOUNT: int = 4
+AGBLOCKS: int = 1000
+BLOCKSIZE: int = 4096
+
+
+def extent(order: int, offset: int, agno: int, agbno: int, count: int
+           ) -> xfs_blockmap:
+    start: int = agno * AGBLOCKS + agbno
+    return xfs_blockmap(order, BLOCKSIZE, f"data offset {offset} startblock {start} ({agno}/{agbno}) count {count} flag 0")  # noqa:E501
+
+
+def columns(seed: int, files: int) -> xfs_extent_columns:
+    """files with shared, adjacent, tied and out of range extents"""
+    rand: random.Random = random.Random(seed)
+    result: xfs_extent_columns = xfs_extent_columns()
+    for ino in range(files):
+        extents = []
+        offset: int = 0
+        for order in range(rand.choice([0, 1, 1, 2, 3, 5, 9])):
+            agno: int = rand.randrange(AGCOUNT + (1 if rand.random() < 0.02 else 0))  # noqa:E501
+            agbno: int = rand.choice([0, 10, 500, AGBLOCKS - 8,
+                                      rand.randrange(AGBLOCKS + 5)])
+            count: int = rand.randrange(1, 40)
+            extents.append(extent(order, offset, agno, agbno, count))
+            offset += count
+        size: int = -1 if rand.random() < 0.05 else\
+            rand.randrange(offset * BLOCKSIZE + 2)
+        result.add(ino=ino, size=size, extents=extents)
+    return result
+
+
+def report(data: xfs_extent_columns) -> Dict[str, Any]:
+    result = xfs_extent_report(data, blocksize=BLOCKSIZE, agcount=AGCOUNT,
+                               agblocks=AGBLOCKS, bins=7)
+    return {name: getattr(result, name) for name in [
+        "damaged", "invalid", "blocks", "histogram", "ag_blocks",
+        "ag_extents", "utilization", "damage", "seek", "seek_sorted"]}
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 64, 1 << 18])
+@pytest.mark.parametrize("seed", range(4))
+def test_numpy_matches_python(seed: int, chunk: int, monkeypatch):
+    pytest.importorskip("numpy")
+    data = columns(seed, files=300)
+    monkeypatch.setattr(xfs_extent_report, "CHUNK", chunk)
+    vectorized = report(data)
+    monkeypatch.setattr(xfs_report, "numpy", None)
+    assert vectorized == report(data)
+
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_shared_blocks_and_seeks(vectorized: bool, monkeypatch):
+    if vectorized:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(xfs_report, "numpy", None)
+    data = xfs_extent_columns()
+    data.add(ino=1, size=BLOCKSIZE * 5, extents=[extent(0, 0, 0, 200, 5)])
+    data.add(ino=2, size=BLOCKSIZE * 10, extents=[extent(0, 0, 0, 100, 10)])
+    data.add(ino=3, size=BLOCKSIZE * 4, extents=[extent(0, 0, 0, 104, 4)])
+    result = report(data)
+    assert result["ag_blocks"] == [15, 0, 0, 0]  # 104..107 once
+    assert result["ag_extents"] == [3, 0, 0, 0]
+    assert result["seek"] == (2, 105 + 6)
+    assert result["seek_sorted"] == (2, 6 + 92)
@@ -0,0 +1,46 @@
+# coding:utf-8
+
+import errno
+import os
+import stat
+from typing import List
+
+from xfs_aid.xfs_aidkit import xfs_rescue
+
+
+def test_metadata_steps(tmp_path, monkeypatch):
+    calls: List[str] = []
+
+    def chown(path, uid, gid):
+        calls.append("owner")
+        raise OSError(errno.EPERM, os.strerror(errno.EPERM))
+
+    def setxattr(path, name, value):
+        calls.append("xattrs")
+
+    def chmod(path, mode):
+        calls.append(f"mode {mode:o}")
+
+    def utime(path, ns):
+        calls.append("times")
+
+    monkeypatch.setattr(os, "chown", chown)
+    monkeypatch.setattr(os, "setxattr", setxattr, raising=False)
+    monkeypatch.setattr(os, "chmod", chmod)
+    monkeypatch.setattr(os, "utime", utime)
+    mode: int = stat.S_ISUID | 0o555
+    failed: List[str] = xfs_rescue.metadata(
+        str(tmp_path), ((1, 1), mode, (0, 0), {"user.a": b"b"}))
+    # a failed owner neither stops the other steps nor keeps setuid
+    assert failed == ["owner"]
+    assert calls == ["owner", "xattrs", "mode 555", "times"]
+
+
+def test_metadata_unread_fields(tmp_path):
+    target = tmp_path / "file"
+    target.write_bytes(b"")
+    os.chmod(target, 0o600)
+    failed: List[str] = xfs_rescue.metadata(
+        str(target), (None, 0o640, None, None))
+    assert failed == ["owner", "xattrs", "times"]
+    assert stat.S_IMODE(os.stat(target).st_mode) == 0o640
@@ -0,0 +1,152 @@
+# coding:utf-8
+
+import os
+import random
+import threading
+import time
+from typing import Dict
+from typing import Generator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import pytest
+
+from xfs_aid.exception import XfsCmdException
+from xfs_aid.xfs_aidkit import xfs_scan
+from xfs_aid.xfs_debug import xfs_content
+from xfs_aid.xfs_walk import xfs_walker
+
+
+def build(fanout: int, depth: int, files: int) -> Dict[str, List[Tuple[str, bool]]]:  # noqa:E501
+    """directory path to its (name, is_dir) entries"""
+    tree: Dict[str, List[Tuple[str, bool]]] = {}
+
+    def add(path: str, level: int) -> None:
+        entries: List[Tuple[str, bool]] = [(f"file{index}", False)
+                                           for index in range(files)]
+        if level < depth:
+            for index in range(fanout):
+                entries.insert(index * 2, (f"dir{index}", True))
+                add(os.path.join(path, f"dir{index}"), level + 1)
+        tree[path] = entries
+
+    add("/", 0)
+    return tree
+
+
+class listing(object):
+    """listdir over a tree, with random delays to shuffle workers"""
+
+    def __init__(self, tree: Dict[str, List[Tuple[str, bool]]],
+                 fail: Optional[str] = None,
+                 error: Optional[str] = None) -> None:
+        self.tree: Dict[str, List[Tuple[str, bool]]] = tree
+        self.fail: Optional[str] = fail
+        self.error: Optional[str] = error
+        self.calls: int = 0
+        self.random: random.Random = random.Random(len(tree))
+        self.lock: threading.Lock = threading.Lock()
+
+    def __call__(self, content: Optional[xfs_content],
+                 entries: List[xfs_content]) -> None:
+        path: str = "/" if content is None else content.path
+        with self.lock:
+            self.calls += 1
+            delay: float = self.random.random() / 2000
+        time.sleep(delay)
+        if path == self.fail:
+            raise XfsCmdException(1, f"ls {path}")
+        if path == self.error:
+            raise RuntimeError(path)
+        stdout: bytes = b"".join(
+            b"%d %d %s 0x0 %d %s (good)\n" % (
+                cookie, cookie, b"directory" if is_dir else b"regular",
+                len(name), name.encode())
+            for cookie, (name, is_dir) in enumerate(self.tree[path]))
+        entries.extend(xfs_content.parse(path, stdout))
+
+
+def serial(tree: Dict[str, List[Tuple[str, bool]]], path: str = "/"
+           ) -> Generator[str, None, None]:
+    """DFS as xfs_scan without jobs, directories after their contents"""
+    for name, is_dir in tree[path]:
+        child: str = os.path.join(path, name)
+        if is_dir:
+            yield from serial(tree, child)
+        yield child
+
+
+@pytest.mark.parametrize("jobs", [1, 2, 4, 8])
+@pytest.mark.parametrize("backlog", [1, 3, None])
+def test_ordered(jobs: int, backlog: Optional[int]):
+    tree = build(fanout=3, depth=3, files=2)
+    walker = xfs_walker(listdir=listing(tree), jobs=jobs, ordered=True,
+                        backlog=backlog)
+    assert [obj.path for obj in walker.walk()] == list(serial(tree))
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_completion(jobs: int):
+    tree = build(fanout=3, depth=3, files=2)
+    walker = xfs_walker(listdir=listing(tree), jobs=jobs, ordered=False,
+                        backlog=2)
+    seen: Set[str] = set()
+    for obj in walker.walk():
+        assert obj.path not in seen
+        if obj.is_dir:  # after its own listing
+            assert all(os.path.join(obj.path, name) in seen
+                       for name, is_dir in tree[obj.path] if not is_dir)
+        seen.add(obj.path)
+    assert seen == set(serial(tree))
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_failed_listing(ordered: bool):
+    tree = build(fanout=2, depth=2, files=1)
+    walker = xfs_walker(listdir=listing(tree, fail="/dir1"), jobs=4,
+                        ordered=ordered)
+    objects: Dict[str, xfs_content] = {obj.path: obj
+                                       for obj in walker.walk()}
+    assert objects["/dir1"].damaged
+    assert not objects["/dir0"].damaged
+    assert not [path for path in objects if path.startswith("/dir1/")]
+    assert set(objects) == {path for path in serial(tree)
+                            if not path.startswith("/dir1/")}
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_error(ordered: bool):
+    tree = build(fanout=2, depth=2, files=1)
+    walker = xfs_walker(listdir=listing(tree, error="/dir0/dir1"), jobs=4,
+                        ordered=ordered)
+    with pytest.raises(RuntimeError, match="/dir0/dir1"):
+        list(walker.walk())
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_close(ordered: bool):
+    threads: int = threading.active_count()
+    tree = build(fanout=4, depth=4, files=2)
+    listdir = listing(tree)
+    walker = xfs_walker(listdir=listdir, jobs=4, ordered=ordered, backlog=4)
+    objects = walker.walk()
+    for _ in range(10):
+        next(objects)
+    objects.close()  # stops and joins the workers
+    assert threading.active_count() == threads
+    calls: int = listdir.calls
+    assert calls < len(tree)
+    time.sleep(0.01)
+    assert listdir.calls == calls
+
+
+def test_scan_unordered_single_job(tmp_path, monkeypatch):
+    tree = build(fanout=2, depth=2, files=1)
+    scanner = xfs_scan(device=str(tmp_path / "device"), jobs=1,
+                       ordered=False)
+    # completion order uses the walker, the serial DFS would run xfs_db
+    monkeypatch.setattr(scanner, "listdir", listing(tree))
+    assert sorted(obj.path for obj in scanner.objects) ==\
+        sorted(serial(tree))
@@ -36,13 +36,15 @@ def run_cmd_file_bmap(cmds: commands) -> int:
 
 @add_command("raw", help="read raw data for an XFS file")
 def add_cmd_file_raw(_arg: argp):
-    pass
+    _arg.add_argument("--direct", action="store_true",
+                      help="direct I/O, bypass the page cache")
 
 
 @run_command(add_cmd_file_raw)
 def run_cmd_file_raw(cmds: commands) -> int:
     file: xfs_file = xfs_file(device=cmds.args.device,
-                              inode_number=cmds.args.inode)
+                              inode_number=cmds.args.inode,
+                              direct=cmds.args.direct)
     file.raw(stream=sys.stdout.buffer)
     return 0
 
@@ -20,16 +20,32 @@ def add_cmd_file(_arg: argp):
                       help="XFS filesystem device")
     _arg.add_argument(dest="target", type=str, metavar="DIR",
                       help="target directory")
+    _arg.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                      help="list N directories concurrently")
+    _arg.add_argument("--unordered", action="store_true",
+                      help="rebuild in completion order instead of DFS, "
+                      "lists concurrently even with one job")
+    _arg.add_argument("--direct", action="store_true",
+                      help="direct I/O, bypass the page cache")
 
 
 @run_command(add_cmd_file)
 def run_cmd_file(cmds: commands) -> int:
     handler: xfs_rescue = xfs_rescue(device=cmds.args.device,
-                                     basedir=cmds.args.target)
+                                     basedir=cmds.args.target,
+                                     jobs=cmds.args.jobs,
+                                     ordered=not cmds.args.unordered,
+                                     direct=cmds.args.direct)
     for obj in handler.xfiles:
         cmds.stdout(f"rebuild inode {obj.ino} size {obj.size} => {obj.target}")
         if not obj.rebuild():
             cmds.stderr(f"rebuild inode {obj.ino} => {obj.target} failed")
+    for target, failed in handler.restore():
+        if failed:
+            cmds.stderr(f"restore {', '.join(failed)} => {target} failed")
+    if handler.shared is not None:
+        cmds.stdout(f"shared extents: {handler.shared.cloned} bytes cloned, "
+                    f"{handler.shared.copied} bytes copied")
     return 0
 
 
@@ -12,6 +12,8 @@ from .attribute import __description__
 from .attribute import __urlhome__
 from .attribute import __version__
 from .xfs_aidkit import xfs_scan
+from .xfs_report import xfs_extent_columns
+from .xfs_report import xfs_extent_report
 
 
 @add_command("all", help="list all contents in XFS filesystem")
@@ -21,7 +23,9 @@ def add_cmd_scan_all(_arg: argp):
 
 @run_command(add_cmd_scan_all)
 def run_cmd_scan_all(cmds: commands) -> int:
-    scanner: xfs_scan = xfs_scan(device=cmds.args.device)
+    scanner: xfs_scan = xfs_scan(device=cmds.args.device,
+                                 jobs=cmds.args.jobs,
+                                 ordered=not cmds.args.unordered)
     for object in scanner.objects:
         cmds.stdout(scanner.show(object))
     return 0
@@ -34,7 +38,9 @@ def add_cmd_scan_damaged(_arg: argp):
 
 @run_command(add_cmd_scan_damaged)
 def run_cmd_scan_damaged(cmds: commands) -> int:
-    scanner: xfs_scan = xfs_scan(device=cmds.args.device)
+    scanner: xfs_scan = xfs_scan(device=cmds.args.device,
+                                 jobs=cmds.args.jobs,
+                                 ordered=not cmds.args.unordered)
     for object in scanner.damaged:
         cmds.stdout(scanner.show(object))
     return 0
@@ -47,20 +53,52 @@ def add_cmd_scan_files(_arg: argp):
 
 @run_command(add_cmd_scan_files)
 def run_cmd_scan_files(cmds: commands) -> int:
-    scanner: xfs_scan = xfs_scan(device=cmds.args.device)
+    scanner: xfs_scan = xfs_scan(device=cmds.args.device,
+                                 jobs=cmds.args.jobs,
+                                 ordered=not cmds.args.unordered)
     for file in scanner.files:
         cmds.stdout(scanner.show(file))
     return 0
 
 
+@add_command("report", help="report fragmentation and damage per AG and file")
+def add_cmd_scan_report(_arg: argp):
+    _arg.add_argument("--bins", type=int, default=16, metavar="N",
+                      help="heatmap bins per AG")
+    _arg.add_argument("--batch", type=int, default=256, metavar="N",
+                      help="inodes per xfs_db run")
+
+
+@run_command(add_cmd_scan_report)
+def run_cmd_scan_report(cmds: commands) -> int:
+    scanner: xfs_scan = xfs_scan(device=cmds.args.device,
+                                 jobs=cmds.args.jobs,
+                                 ordered=not cmds.args.unordered,
+                                 check=False)
+    columns: xfs_extent_columns = xfs_extent_columns.gather(
+        scanner=scanner, batch=cmds.args.batch)
+    sb = scanner.debug.primary_sb
+    report: xfs_extent_report = xfs_extent_report(
+        columns=columns, blocksize=sb.blocksize, agcount=sb.agcount,
+        agblocks=sb.agblocks, bins=cmds.args.bins)
+    for line in report.show():
+        cmds.stdout(line)
+    return 0
+
+
 @add_command("xfs-scan", help="scan XFS filesystem")
 def add_cmd_scan(_arg: argp):
     _arg.add_argument(dest="device", type=str, metavar="DEV",
                       help="XFS filesystem device")
+    _arg.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                      help="list N directories concurrently")
+    _arg.add_argument("--unordered", action="store_true",
+                      help="output in completion order instead of DFS, "
+                      "lists concurrently even with one job")
 
 
 @run_command(add_cmd_scan, add_cmd_scan_all, add_cmd_scan_damaged,
-             add_cmd_scan_files)
+             add_cmd_scan_files, add_cmd_scan_report)
 def run_cmd_scan(cmds: commands) -> int:
     return 0
 
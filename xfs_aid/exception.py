@@ -26,6 +26,16 @@ class XfsBmapException(XfsAidException):
         super().__init__(f"Failed to parse bmap: {text}")
 
 
+class XfsLsException(XfsAidException):
+    def __init__(self, text: str):
+        super().__init__(f"Failed to parse ls: {text}")
+
+
+class XfsAttrException(XfsAidException):
+    def __init__(self, aformat: str):
+        super().__init__(f"Unsupported attribute fork format: {aformat}")
+
+
 class XfsAidTargetExistsException(XfsAidException):
     def __init__(self, target: str):
         super().__init__(f"Taget '{target}' already exists")
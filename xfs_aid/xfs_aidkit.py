@@ -1,23 +1,41 @@
 # coding:utf-8
 
 import os
+import stat
+import threading
 from typing import Any
 from typing import BinaryIO
+from typing import Callable
+from typing import Dict
 from typing import Generator
+from typing import List
 from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from xarg import cmds
 
 from .exception import XfsAidDirectoryNotEmptyException
 from .exception import XfsAidTargetExistsException
+from .exception import XfsAttrException
 from .exception import XfsCmdException
 from .xfs_debug import xfs_blockmap
 from .xfs_debug import xfs_content
 from .xfs_debug import xfs_db
 from .xfs_debug import xfs_inode
+from .xfs_direct import xfs_direct
+from .xfs_reflink import xfs_shared_extents
 from .xfs_util import is_empty_directory
+from .xfs_walk import xfs_walker
+
+# (uid, gid), mode, (atime, mtime) in nanoseconds and extended attributes,
+# None where the inode field could not be read
+xfs_metadata = Tuple[Optional[Tuple[int, int]], Optional[int],
+                     Optional[Tuple[int, int]], Optional[Dict[str, bytes]]]
 
 
 class xfs_file(object):
-    def __init__(self, device: str, inode_number: int):
+    def __init__(self, device: str, inode_number: int, direct: bool = False):
         debug: xfs_db = xfs_db(device=device)
         inode: xfs_inode = debug.inode(inode_number)
         assert inode.v3_inumber == inode_number, f"inode number {inode_number} error"  # noqa:E501
@@ -25,6 +43,7 @@ class xfs_file(object):
         self.__inode: xfs_inode = inode
         self.__inode_number: int = inode_number
         self.__file_size: int = inode.core_size
+        self.__direct: bool = direct
 
     @property
     def ino(self) -> int:
@@ -44,6 +63,11 @@ class xfs_file(object):
         """file size"""
         return self.__file_size
 
+    @property
+    def direct(self) -> bool:
+        """read with direct I/O, bypass the page cache"""
+        return self.__direct
+
     @property
     def damaged(self) -> bool:
         return not self.is_good()
@@ -58,22 +82,49 @@ class xfs_file(object):
             good = False  # check extents blocks error
         return good
 
+    def read_blocks(self, rhdl: Union[BinaryIO, xfs_direct],
+                    stream: BinaryIO, startblock: int, count: int,
+                    offset: int) -> int:
+        """copy device blocks to stream at file offset, return new offset"""
+        blocksize: int = self.debug.blocksize
+        if isinstance(rhdl, xfs_direct):
+            # whole blocks, trim the partial tail block to file size
+            for data in rhdl.read(startblock * blocksize, count * blocksize):
+                size: int = min(self.size - offset, len(data))
+                if size <= 0:
+                    break
+                stream.write(data[:size])
+                offset += size
+            stream.flush()
+            return offset
+        rhdl.seek(startblock * blocksize, 0)
+        for _ in range(count):
+            size: int = min(self.size - offset, blocksize)
+            offset += size
+            assert offset <= self.size, f"inode {self.ino} offset {offset} (size {self.size}) error"  # noqa:E501
+            data: bytes = rhdl.read(size)
+            stream.write(data)
+            stream.flush()
+        return offset
+
+    def read_extent(self, rhdl: Union[BinaryIO, xfs_direct],
+                    stream: BinaryIO, extent: xfs_blockmap,
+                    offset: int) -> int:
+        """copy an extent to stream at file offset, return new offset"""
+        return self.read_blocks(rhdl=rhdl, stream=stream, offset=offset,
+                                startblock=extent.startblock,
+                                count=extent.count)
+
     def raw(self, stream: BinaryIO) -> bool:
         """read raw date from an XFS file"""
-        with open(self.debug.device, "rb") as rhdl:
+        with xfs_direct(self.debug.device, alignment=self.debug.blocksize)\
+                if self.direct else open(self.debug.device, "rb") as rhdl:
             offset: int = 0
             blocksize: int = self.debug.blocksize
             for extent in self.extents:
                 assert extent.blocksize == blocksize, f"inode {self.ino} blocksize {extent.blocksize} error"  # noqa:E501
                 assert extent.startoffset * blocksize == offset, f"inode {self.ino} offset {offset} error"  # noqa:E501
-                rhdl.seek(extent.startblock * blocksize, 0)
-                for _ in range(extent.count):
-                    size: int = min(self.size - offset, blocksize)
-                    offset += size
-                    assert offset <= self.size, f"inode {self.ino} offset {offset} (size {self.size}) error"  # noqa:E501
-                    data: bytes = rhdl.read(size)
-                    stream.write(data)
-                    stream.flush()
+                offset = self.read_extent(rhdl, stream, extent, offset)
             assert self.size == offset, f"inode {self.ino} offset {offset} (size {self.size}) error"  # noqa:E501
         return True
 
@@ -91,15 +142,37 @@ class xfs_file(object):
 
 
 class xfs_scan(object):
-    def __init__(self, device: str):
+    def __init__(self, device: str, jobs: int = 1, ordered: bool = True,
+                 check: bool = True):
+        # jobs > 1 lists directories concurrently, see xfs_walker, and so
+        # does ordered=False (completion order) with a single job
+        # check=False skips reading inode and bmap of every file
         self.__debug: xfs_db = xfs_db(device=device)
         self.__max_inode_number: int = 0
         self.__max_inode_dispaly: int = 10
+        self.__max_inode_lock: threading.Lock = threading.Lock()
+        self.__jobs: int = jobs
+        self.__ordered: bool = ordered
+        self.__check: bool = check
 
     @property
     def debug(self):
         return self.__debug
 
+    @property
+    def jobs(self) -> int:
+        """concurrent directory listings"""
+        return self.__jobs
+
+    @property
+    def ordered(self) -> bool:
+        return self.__ordered
+
+    @property
+    def check(self) -> bool:
+        """check files for damage while scanning"""
+        return self.__check
+
     @property
     def max_ino(self) -> int:
         """inode number maximum"""
@@ -107,18 +180,44 @@ class xfs_scan(object):
 
     @max_ino.setter
     def max_ino(self, value: int):
-        if value > self.__max_inode_number:
-            self.__max_inode_number = value
-            self.__max_inode_dispaly = max(len(str(value)), 10)
+        with self.__max_inode_lock:
+            if value > self.__max_inode_number:
+                self.__max_inode_number = value
+                self.__max_inode_dispaly = max(len(str(value)), 10)
 
     @property
     def max_ino_display(self) -> int:
         """inode number display character maximum"""
         return self.__max_inode_dispaly
 
+    def listdir(self, content: Optional[xfs_content],
+                entries: List[xfs_content]) -> None:
+        """list a directory (None is root) and check its files"""
+        if content is not None:
+            path: str = content.path
+            inode: Optional[int] = content.ino
+            self.max_ino = inode
+        else:  # start from root
+            path: str = "/"
+            inode: Optional[int] = None
+
+        for entry in self.debug.ls(path=path, inode=inode):
+            if entry.is_file and self.check:
+                xfile: xfs_file = xfs_file(device=self.debug.device,
+                                           inode_number=entry.ino)
+                if xfile.damaged:
+                    entry.damaged = True
+            entries.append(entry)
+
     @property
     def objects(self) -> Generator[xfs_content, Any, None]:
         """all objects"""
+        if self.jobs > 1 or not self.ordered:
+            walker: xfs_walker = xfs_walker(listdir=self.listdir,
+                                            jobs=self.jobs,
+                                            ordered=self.ordered)
+            yield from walker.walk()
+            return
 
         def dfs(content: Optional[xfs_content] = None):
             if content is not None:
@@ -133,7 +232,7 @@ class xfs_scan(object):
                 for content in self.debug.ls(path=path, inode=inode):
                     if content.is_dir:  # deep first
                         yield from dfs(content)
-                    elif content.is_file:
+                    elif content.is_file and self.check:
                         xfile: xfs_file = xfs_file(device=self.debug.device,
                                                    inode_number=content.ino)
                         if xfile.damaged:
@@ -169,36 +268,204 @@ class xfs_scan(object):
 class xfs_rescue(xfs_scan):
 
     class _file(xfs_file):
-        def __init__(self, device: str, inode_number: int, target: str):
-            super().__init__(device=device, inode_number=inode_number)
+        def __init__(self, device: str, inode_number: int, target: str,
+                     shared: Optional[xfs_shared_extents] = None,
+                     direct: bool = False):
+            super().__init__(device=device, inode_number=inode_number,
+                             direct=direct)
             self.__target: str = target
+            self.__rebuilt: bool = False
+            self.__shared: Optional[xfs_shared_extents] = shared
+            self.__pending: List[Tuple[int, int, int, int]] = []
 
         @property
         def target(self) -> str:
             return self.__target
 
+        @property
+        def rebuilt(self) -> bool:
+            return self.__rebuilt
+
+        def __read_device(self, rhdl: Union[BinaryIO, xfs_direct],
+                          stream: BinaryIO, startblock: int, count: int,
+                          offset: int) -> int:
+            end: int = self.read_blocks(rhdl=rhdl, stream=stream,
+                                        startblock=startblock, count=count,
+                                        offset=offset)
+            if end > offset:  # index once rebuilt
+                self.__pending.append((startblock, startblock + count,
+                                       offset, end - offset))
+            return end
+
+        def read_extent(self, rhdl: Union[BinaryIO, xfs_direct],
+                        stream: BinaryIO, extent: xfs_blockmap,
+                        offset: int) -> int:
+            """reuse blocks already rescued, read the rest from device"""
+            shared: Optional[xfs_shared_extents] = self.__shared
+            if shared is None:
+                return super().read_extent(rhdl, stream, extent, offset)
+            block: int = extent.startblock
+            for start, end, source, source_offset, nbytes in\
+                    shared.lookup(extent.startblock, extent.endblock):
+                if end <= block:
+                    continue
+                if start < block:  # never go back over blocks written
+                    skip: int = (block - start) * extent.blocksize
+                    start, source_offset, nbytes =\
+                        block, source_offset + skip, nbytes - skip
+                    if nbytes <= 0:
+                        continue
+                if start > block:
+                    offset = self.__read_device(rhdl, stream, block,
+                                                start - block, offset)
+                length: int = min((end - start) * extent.blocksize,
+                                  self.size - offset)
+                if length > nbytes:  # source ends early, use whole blocks
+                    end = start + nbytes // extent.blocksize
+                    length = (end - start) * extent.blocksize
+                if length > 0:
+                    shared.copy(target=source, offset=source_offset,
+                                length=length, stream=stream,
+                                position=offset)
+                    offset += length
+                block = end
+            if block < extent.endblock:
+                offset = self.__read_device(rhdl, stream, block,
+                                            extent.endblock - block, offset)
+            return offset
+
         def rebuild(self) -> bool:
             """rebuild file"""
             dir: str = os.path.dirname(self.target)
             if not os.path.exists(dir):
                 os.makedirs(dir)
-            return self.dump(target=self.target)
-
-    def __init__(self, device: str, basedir: str):
+            self.__pending.clear()
+            self.__rebuilt = self.dump(target=self.target)
+            if self.__rebuilt and self.__shared is not None:
+                for start, end, offset, nbytes in self.__pending:
+                    self.__shared.add(startblock=start, endblock=end,
+                                      target=self.target, offset=offset,
+                                      nbytes=nbytes)
+            self.__pending.clear()
+            return self.__rebuilt
+
+    def __init__(self, device: str, basedir: str, jobs: int = 1,
+                 ordered: bool = True, direct: bool = False):
         if not is_empty_directory(dir=basedir):
             raise XfsAidDirectoryNotEmptyException(basedir)
-        super().__init__(device=device)
+        super().__init__(device=device, jobs=jobs, ordered=ordered)
         self.__basedir: str = basedir
+        self.__direct: bool = direct
+        # index rescued extents only when the volume can share them
+        self.__shared: Optional[xfs_shared_extents] =\
+            xfs_shared_extents(blocksize=self.debug.blocksize)\
+            if self.debug.primary_sb.reflink else None
+        self.__files: List[Tuple[str, xfs_metadata]] = []
+        self.__dirs: List[Tuple[str, int]] = []
 
     @property
     def base(self) -> str:
         """base directory"""
         return self.__basedir
 
+    @property
+    def shared(self) -> Optional[xfs_shared_extents]:
+        """rescued extents index, None if the volume has no reflink"""
+        return self.__shared
+
     @property
     def xfiles(self) -> Generator[_file, Any, None]:
-        for file in self.files:
-            target: str = os.path.join(self.base, file.path[1:])
-            yield self._file(device=self.debug.device,
-                             inode_number=file.ino,
-                             target=target)
+        """all good files to rebuild, metadata is restored later in batch"""
+        for obj in self.objects:
+            if obj.damaged:
+                continue
+            target: str = os.path.join(self.base, obj.path[1:])
+            if obj.is_dir:
+                self.__dirs.append((target, obj.ino))
+            elif obj.is_file:
+                xfile = self._file(device=self.debug.device,
+                                   inode_number=obj.ino,
+                                   target=target,
+                                   shared=self.shared,
+                                   direct=self.__direct)
+                yield xfile
+                if xfile.rebuilt:  # reuse the inode fetched for rebuild
+                    self.__files.append((target, self.extract(xfile.inode)))
+
+    @classmethod
+    def extract(cls, inode: xfs_inode) -> xfs_metadata:
+        """metadata to restore, keeps only the fields needed"""
+
+        def field(getter: Callable[[], Any]) -> Any:
+            try:
+                return getter()
+            except (KeyError, ValueError, XfsAttrException) as error:
+                cmds.logger.warning(f"inode {inode.v3_inumber}: {error}")
+                return None
+
+        return (field(lambda: (inode.core_uid, inode.core_gid)),
+                field(lambda: stat.S_IMODE(inode.core_mode)),
+                field(lambda: (inode.core_atime, inode.core_mtime)),
+                field(lambda: inode.xattrs))
+
+    @classmethod
+    def metadata(cls, target: str, metadata: xfs_metadata) -> List[str]:
+        """restore owner, extended attributes, mode and timestamps
+
+        Every step is applied even if an earlier one failed, e.g. owner
+        as non-root or on a target without ownership. Returns the failed
+        steps.
+        """
+        owner, mode, times, xattrs = metadata
+        failed: List[str] = []
+
+        def apply(step: str, value: Any, action: Callable[[Any], None]
+                  ) -> None:
+            try:
+                if value is None:  # field not read from inode
+                    raise ValueError(step)
+                action(value)
+            except (OSError, ValueError):
+                failed.append(step)
+
+        def setxattrs(xattrs: Dict[str, bytes]) -> None:
+            for name, value in xattrs.items():
+                os.setxattr(target, name, value)
+
+        # chown first, changing owner clears setuid/setgid and capabilities
+        apply("owner", owner, lambda owner: os.chown(target, *owner))
+        # xattrs before chmod, a read-only mode forbids setting user.*
+        apply("xattrs", xattrs, setxattrs)
+        if "owner" in failed and mode is not None:
+            mode &= ~(stat.S_ISUID | stat.S_ISGID)  # not for another owner
+        apply("mode", mode, lambda mode: os.chmod(target, mode))
+        # timestamps last, any other change could touch them
+        apply("times", times, lambda times: os.utime(target, ns=times))
+        return failed
+
+    def restore(self) -> Generator[Tuple[str, List[str]], Any, None]:
+        """restore metadata of all rebuilt files and directories
+
+        Files go first, then directories bottom-up (deepest first) so that
+        writing a directory's contents no longer changes its timestamps.
+        Yields every target and its failed steps, empty if all restored.
+        """
+        files: List[Tuple[str, xfs_metadata]] = self.__files
+        self.__files = []
+        for target, metadata in files:
+            yield target, self.metadata(target=target, metadata=metadata)
+
+        dirs: List[Tuple[str, int]] = self.__dirs
+        self.__dirs = []
+        dirs.sort(key=lambda item: item[0].count(os.sep), reverse=True)
+        for target, ino in dirs:
+            try:
+                os.makedirs(target, exist_ok=True)  # empty directory
+                # not cached by self.debug, only the extracted fields stay
+                inode: xfs_inode = xfs_inode(
+                    self.debug.command(f"inode {ino}", "print"))
+            except (OSError, KeyError, ValueError, XfsCmdException):
+                yield target, ["inode"]
+                continue
+            yield target, self.metadata(target=target,
+                                        metadata=self.extract(inode))
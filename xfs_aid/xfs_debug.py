@@ -1,20 +1,28 @@
 # coding:utf-8
 
+import codecs
+import logging
 import os
 import re
 import subprocess
+import time
 from typing import Any
 from typing import Dict
 from typing import Generator
 from typing import List
 from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
 
 from xarg import cmds
 
 from .exception import DevIsMountException
 from .exception import XfsAgnoException
+from .exception import XfsAttrException
 from .exception import XfsBmapException
 from .exception import XfsCmdException
+from .exception import XfsLsException
 from .xfs_util import is_mount_device
 from .xfs_util import xfs_kv
 
@@ -45,10 +53,21 @@ class xfs_superblock(xfs_kv):
     def agblocks(self) -> int:
         return self.__agblocks
 
+    @property
+    def reflink(self) -> bool:
+        """XFS_SB_FEAT_RO_COMPAT_REFLINK, data extents may be shared"""
+        value: str = self.get("features_ro_compat", "0").split()[0]
+        return bool(int(value, 0) & 0x4)
+
 
 class xfs_inode(xfs_kv):
     """inode"""
 
+    # core.atime.sec = Tue Jun 13 10:27:56 2023
+    TIME_FORMAT = "%a %b %d %H:%M:%S %Y"
+    # a.sfattr.list[0].name = "name"
+    SFATTR_PATTERN = re.compile(r"^[ \t]*a\.sfattr\.list\[(?P<index>\d+)\]\.(?P<field>\w+)[ \t]*=(?P<value>[^\n]*)$", re.M)  # noqa:E501
+
     def __init__(self, text: str) -> None:
         super().__init__(text)
         self.__core_size: int = int(self["core.size"])
@@ -62,67 +81,165 @@ class xfs_inode(xfs_kv):
     def v3_inumber(self) -> int:
         return self.__v3_inumber
 
+    @property
+    def core_mode(self) -> int:
+        """file type and permission bits"""
+        return int(self["core.mode"], 8)
+
+    @property
+    def core_uid(self) -> int:
+        return int(self["core.uid"])
+
+    @property
+    def core_gid(self) -> int:
+        return int(self["core.gid"])
+
+    def timestamp(self, name: str) -> int:
+        """timestamp in nanoseconds, name is atime, mtime or ctime"""
+        sec: str = self[f"core.{name}.sec"]
+        seconds: int = int(time.mktime(time.strptime(sec, self.TIME_FORMAT)))
+        return seconds * 1000000000 + int(self[f"core.{name}.nsec"])
+
+    @property
+    def core_atime(self) -> int:
+        """last access time in nanoseconds"""
+        return self.timestamp("atime")
+
+    @property
+    def core_mtime(self) -> int:
+        """last modification time in nanoseconds"""
+        return self.timestamp("mtime")
+
+    @property
+    def xattrs(self) -> Dict[str, bytes]:
+        """shortform extended attributes
+
+        Raises XfsAttrException if the attributes are stored outside the
+        inode (extents or btree attribute fork), those are not printed.
+        """
+        aformat: str = self.get("core.aformat", "1 (local)")
+        if aformat.split()[0] != "1" and\
+                int(self.get("core.naextents", "0")) > 0:
+            raise XfsAttrException(aformat=aformat)
+        fields: Dict[int, Dict[str, str]] = {}
+        for match in self.SFATTR_PATTERN.finditer(self.text):
+            index: int = int(match.group("index"))
+            fields.setdefault(index, {})[match.group("field")] =\
+                match.group("value").strip()
+
+        def unquote(value: str) -> bytes:
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            return codecs.escape_decode(os.fsencode(value))[0]  # type: ignore
+
+        xattrs: Dict[str, bytes] = {}
+        for index in sorted(fields):
+            field: Dict[str, str] = fields[index]
+            if "name" not in field:
+                continue
+            namespace: str = "trusted." if field.get("root") == "1" else\
+                "security." if field.get("secure") == "1" else "user."
+            name: str = os.fsdecode(unquote(field["name"]))
+            xattrs[namespace + name] = unquote(field.get("value", '""'))
+        return xattrs
+
 
 class xfs_content(object):
     """xfs_db ls object"""
 
-    def __init__(self, path: str, text: str) -> None:
-        # directory cookie, inode number, file type, hash, name length, name.
-        output: List[str] = [i.strip() for i in text.strip().split(maxsplit=4)]
-        cmds.logger.debug(f"xfs_db_content entry: {text} => {output}")
-        self.__directory_cookie: int = int(output[0])
-        self.__inode_number: int = int(output[1])
-        self.__file_type: str = output[2]
-        self.__hash: str = output[3]
-        # Handle name length and name, name may contain spaces
-        index: int = output[4].index(" ")
-        start: int = index + 1
-        name_length: int = int(output[4][:index].strip())  # bytes
-        name_bytes: bytes = output[4][start:].encode()
-        name: str = name_bytes[:name_length].decode()
-        self.__name_length: int = name_length
-        self.__name: str = name
-        self.__path: str = os.path.join(path, name)
+    # directory cookie, inode number, file type, hash, name length, name.
+    # name may contain spaces and newlines and is not valid UTF-8
+    # necessarily, exactly name length bytes after the match belong to it,
+    # e.g. " (good)" is appended.
+    PATTERN = re.compile(rb"^[ \t]*(?P<cookie>\d+)[ \t]+(?P<inode>\d+)[ \t]+(?P<filetype>\S+)[ \t]+(?P<hash>\S+)[ \t]+(?P<nlen>\d+) ", re.M)  # noqa:E501
+
+    def __init__(self, path: str, text: Union[str, bytes]) -> None:
+        line: bytes = os.fsencode(text) if isinstance(text, str) else text
+        match: Optional[re.Match[bytes]] = self.PATTERN.search(line)
+        if match is None:
+            raise XfsLsException(text=os.fsdecode(line))
+        self.__setup(path, match)
+
+    def __setup(self, path: str, match: "re.Match[bytes]") -> int:
+        """returns the end of the name in the matched text"""
+        end: int = match.end() + int(match.group("nlen"))
+        if end > len(match.string):  # name cut off
+            raise XfsLsException(text=os.fsdecode(match.string[match.start():]))  # noqa:E501
+        # fields are extracted from the match on demand
+        self.__match: re.Match[bytes] = match
+        self.__parent: str = path
+        self.__inode_number: Optional[int] = None
+        self.__name: Optional[str] = None
         self.__damaged: bool = False
+        if cmds.logger.isEnabledFor(logging.DEBUG):
+            cmds.logger.debug(f"xfs_db_content entry: {match.string[match.start():end]!r}")  # noqa:E501
+        return end
+
+    @classmethod
+    def parse(cls, path: str, stdout: bytes
+              ) -> Generator["xfs_content", Any, None]:
+        """parse all entries of an xfs_db ls output in one pass
+
+        A match starting within the previous name (which holds a newline)
+        is part of that name, never the next entry.
+        """
+        offset: int = 0
+        for match in cls.PATTERN.finditer(stdout):
+            if match.start() < offset:
+                continue
+            content: xfs_content = cls.__new__(cls)
+            offset = content.__setup(path, match)
+            yield content
 
     @property
     def directory_cookie(self) -> int:
-        return self.__directory_cookie
+        return int(self.__match.group("cookie"))
 
     @property
     def ino(self) -> int:
         """inode number"""
+        if self.__inode_number is None:
+            self.__inode_number = int(self.__match.group("inode"))
         return self.__inode_number
 
     @property
     def filetype(self) -> str:
         """file type"""
-        return self.__file_type
+        return self.__match.group("filetype").decode()
 
     @property
     def is_dir(self) -> bool:
-        return self.filetype == "directory"
+        return self.__match.group("filetype") == b"directory"
 
     @property
     def is_file(self) -> bool:
-        return self.filetype == "regular"
+        return self.__match.group("filetype") == b"regular"
 
     @property
     def hash(self) -> str:
-        return self.__hash
+        return self.__match.group("hash").decode()
 
     @property
     def nlen(self) -> int:
         """name length"""
-        return self.__name_length
+        return int(self.__match.group("nlen"))
+
+    @property
+    def name_bytes(self) -> bytes:
+        """raw name, exactly as stored in the directory"""
+        start: int = self.__match.end()
+        return self.__match.string[start:start + self.nlen]
 
     @property
     def name(self) -> str:
+        """name decoded by os.fsdecode(), os.fsencode() gives raw bytes"""
+        if self.__name is None:
+            self.__name = os.fsdecode(self.name_bytes)
         return self.__name
 
     @property
     def path(self) -> str:
-        return self.__path
+        return os.path.join(self.__parent, self.name)
 
     @property
     def damaged(self) -> bool:
@@ -136,24 +253,43 @@ class xfs_content(object):
 class xfs_blockmap(object):
     """xfs_db bmap object"""
 
-    PATTERN = re.compile(r'data offset (?P<offset>\d+) startblock (?P<startblock>\d+) \((?P<agno>\d+)/(?P<agbno>\d+)\) count (?P<blockcount>\d+) flag (?P<extentflag>\d+)')  # noqa:E501
+    PATTERN = re.compile(rb'data offset (?P<offset>\d+) startblock (?P<startblock>\d+) \((?P<agno>\d+)/(?P<agbno>\d+)\) count (?P<blockcount>\d+) flag (?P<extentflag>\d+)')  # noqa:E501
 
-    def __init__(self, order: int, blocksize: int, text: str) -> None:
+    def __init__(self, order: int, blocksize: int, text: Union[str, bytes]
+                 ) -> None:
         # noqa:E501 data offset <offset> startblock <startblock> (<agno>/<ag_startblock>) count <blockcount> flag <int>
-        items: Optional[re.Match[str]] = self.PATTERN.match(text)
+        line: bytes = os.fsencode(text) if isinstance(text, str) else text
+        items: Optional[re.Match[bytes]] = self.PATTERN.match(line)
         if items is None:
-            raise XfsBmapException(text=text)
-        blocks: int = int(items.group("blockcount"))
+            raise XfsBmapException(text=os.fsdecode(line))
+        self.__setup(order, blocksize, items)
+
+    def __setup(self, order: int, blocksize: int, items: "re.Match[bytes]"
+                ) -> None:
+        offset, startblock, agno, agbno, blocks, flag = map(int, items.groups())  # noqa:E501
         self.__extent: int = order
         self.__blockcount: int = blocks
         self.__blocksize: int = blocksize
-        self.__startoffset: int = int(items.group("offset"))
-        self.__endoffset: int = self.__startoffset + blocks
-        self.__startblock: int = int(items.group("startblock"))
-        self.__endblock: int = self.__startblock + blocks
-        self.__ag_number: int = int(items.group("agno"))
-        self.__ag_startblock: int = int(items.group("agbno"))
-        self.__extentflag: int = int(items.group("extentflag"))
+        self.__startoffset: int = offset
+        self.__startblock: int = startblock
+        self.__ag_number: int = agno
+        self.__ag_startblock: int = agbno
+        self.__extentflag: int = flag
+
+    @classmethod
+    def parse(cls, blocksize: int, stdout: bytes
+              ) -> Generator["xfs_blockmap", Any, None]:
+        """parse all extents of an xfs_db bmap output in one pass"""
+        offset: int = 0
+        for order, items in enumerate(cls.PATTERN.finditer(stdout)):
+            if stdout[offset:items.start()].strip():  # unparsed text
+                raise XfsBmapException(text=os.fsdecode(stdout[offset:items.start()].strip()))  # noqa:E501
+            offset = items.end()
+            extent: xfs_blockmap = cls.__new__(cls)
+            extent.__setup(order, blocksize, items)
+            yield extent
+        if stdout[offset:].strip():
+            raise XfsBmapException(text=os.fsdecode(stdout[offset:].strip()))
 
     @property
     def extent(self) -> int:
@@ -176,7 +312,7 @@ class xfs_blockmap(object):
     @property
     def endoffset(self) -> int:
         """last block offset starting from file"""
-        return self.__endoffset
+        return self.__startoffset + self.__blockcount
 
     @property
     def startblock(self) -> int:
@@ -186,7 +322,7 @@ class xfs_blockmap(object):
     @property
     def endblock(self) -> int:
         """last block offset starting from device"""
-        return self.__endblock
+        return self.__startblock + self.__blockcount
 
     @property
     def agno(self) -> int:
@@ -213,6 +349,10 @@ class xfs_blockmap(object):
 
 
 class xfs_db(object):
+
+    # printed before the bmap of every inode by bmaps()
+    BMAPS_PATTERN = re.compile(rb"^core\.size = (?P<size>\d+)\n", re.M)
+
     def __init__(self, device: str) -> None:
         if is_mount_device(device=device):
             raise DevIsMountException(device)
@@ -237,19 +377,21 @@ class xfs_db(object):
     def agcount(self) -> int:
         return self.primary_sb.agcount
 
-    def command(self, *cmds: str) -> str:
+    def command_bytes(self, *cmds: str) -> bytes:
         para: str = " ".join(f"-c '{cmd}'" for cmd in cmds)
         args: str = f"xfs_db {self.device} {para}"
         comp: subprocess.CompletedProcess = subprocess.run(
             args=args, shell=True,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
+            stderr=subprocess.PIPE
         )
         if comp.returncode != 0:
             raise XfsCmdException(comp.returncode, args)
         return comp.stdout
 
+    def command(self, *cmds: str) -> str:
+        return os.fsdecode(self.command_bytes(*cmds))
+
     def sb(self, agno: int) -> xfs_superblock:
         # check agno at [0, agcount), ag 0 is primary
         if agno != 0 and agno not in range(self.agcount):
@@ -268,16 +410,49 @@ class xfs_db(object):
     def ls(self, path: str, inode: Optional[int] = None
            ) -> Generator[xfs_content, Any, None]:
         """List the contents of a directory."""
-        stdout: str = self.command(f"ls {path}") if inode is None else\
-            self.command(f"inode {inode}", "ls")
+        stdout: bytes = self.command_bytes(f"ls {path}") if inode is None\
+            else self.command_bytes(f"inode {inode}", "ls")
 
-        for line in stdout.splitlines()[1:]:
-            content: xfs_content = xfs_content(path, line)
-            if content.name in [".", ".."]:
+        for content in xfs_content.parse(path, stdout):
+            if content.name_bytes in (b".", b".."):
                 continue
             yield content
 
     def bmap(self, inode_number: int) -> Generator[xfs_blockmap, Any, None]:
         """Show the block map for the current inode."""
-        for index, value in enumerate(self.command(f"inode {inode_number}", "bmap").splitlines()):  # noqa:E501
-            yield xfs_blockmap(order=index, blocksize=self.blocksize, text=value)  # noqa:E501
+        stdout: bytes = self.command_bytes(f"inode {inode_number}", "bmap")
+        yield from xfs_blockmap.parse(self.blocksize, stdout)
+
+    def bmaps(self, inode_numbers: Sequence[int]
+              ) -> Generator[Tuple[int, int, List[xfs_blockmap]], Any, None]:
+        """Block maps of many inodes with one xfs_db run.
+
+        Yields (inode number, file size, extents), file size is -1 if the
+        inode could not be read.
+        """
+        cmds: List[str] = []
+        for inode_number in inode_numbers:
+            cmds.extend((f"inode {inode_number}",
+                         "print core.size", "bmap"))
+        try:
+            stdout: bytes = self.command_bytes(*cmds)
+            heads: List[re.Match[bytes]] = list(self.BMAPS_PATTERN.finditer(stdout))  # noqa:E501
+        except XfsCmdException:
+            heads = []
+        if len(heads) != len(inode_numbers):
+            if len(inode_numbers) == 1:
+                yield inode_numbers[0], -1, []
+                return
+            for inode_number in inode_numbers:  # find the bad one
+                yield from self.bmaps([inode_number])
+            return
+        for index, head in enumerate(heads):
+            end: int = heads[index + 1].start() if index + 1 < len(heads)\
+                else len(stdout)
+            try:
+                extents: List[xfs_blockmap] = list(xfs_blockmap.parse(
+                    self.blocksize, stdout[head.end():end]))
+            except XfsBmapException:
+                yield inode_numbers[index], -1, []
+                continue
+            yield inode_numbers[index], int(head.group("size")), extents
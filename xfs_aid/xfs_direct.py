@@ -0,0 +1,159 @@
+# coding:utf-8
+
+import errno
+import fcntl
+import mmap
+import os
+import stat
+import struct
+import threading
+from typing import Any
+from typing import Generator
+from typing import List
+
+
+class xfs_buffer_pool(object):
+    """reusable mmap backed buffers, page aligned as O_DIRECT requires"""
+
+    def __init__(self, bufsize: int = 1 << 20, maximum: int = 8) -> None:
+        self.__bufsize: int = bufsize
+        self.__maximum: int = maximum
+        self.__idle: List[mmap.mmap] = []
+        self.__lock: threading.Lock = threading.Lock()
+
+    @property
+    def bufsize(self) -> int:
+        return self.__bufsize
+
+    def acquire(self) -> mmap.mmap:
+        with self.__lock:
+            if self.__idle:
+                return self.__idle.pop()
+        return mmap.mmap(-1, self.bufsize)
+
+    def release(self, buffer: mmap.mmap) -> None:
+        with self.__lock:
+            if len(self.__idle) < self.__maximum:
+                self.__idle.append(buffer)
+                return
+        buffer.close()
+
+
+BUFFER_POOL: xfs_buffer_pool = xfs_buffer_pool()
+
+
+class xfs_direct(object):
+    """direct I/O device reader, bypasses the page cache
+
+    Reads whole aligned blocks with os.preadv into pooled buffers. O_DIRECT
+    needs offsets and sizes aligned to the logical sector size of the
+    backing device, which may be larger than the XFS block size (e.g. an
+    image with 1 KiB blocks on a 4Kn disk), so reads start at the sector
+    and skip the head. If the file cannot be opened or read with O_DIRECT
+    (e.g. tmpfs), it falls back to normal reads and drops the pages read
+    with POSIX_FADV_DONTNEED.
+    """
+
+    # linux/fs.h: _IO(0x12, 104), logical sector size of a block device
+    BLKSSZGET: int = 0x1268
+
+    def __init__(self, device: str, alignment: int,
+                 pool: xfs_buffer_pool = BUFFER_POOL) -> None:
+        assert pool.bufsize % alignment == 0, f"buffer size {pool.bufsize} not aligned to {alignment}"  # noqa:E501
+        self.__device: str = device
+        self.__alignment: int = alignment
+        self.__pool: xfs_buffer_pool = pool
+        try:
+            self.__fd: int = os.open(device, os.O_RDONLY | os.O_DIRECT)
+            self.__direct: bool = True
+        except OSError as error:
+            if error.errno != errno.EINVAL:
+                raise
+            self.__fd = os.open(device, os.O_RDONLY)
+            self.__direct = False
+        self.__sector: int = self.sector_size(self.__fd)
+        if pool.bufsize % self.__sector != 0:
+            self.__buffered()
+
+    def __enter__(self) -> "xfs_direct":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    @property
+    def direct(self) -> bool:
+        """O_DIRECT in use"""
+        return self.__direct
+
+    @property
+    def sector(self) -> int:
+        """O_DIRECT alignment of the backing device"""
+        return self.__sector
+
+    @classmethod
+    def sector_size(cls, fd: int) -> int:
+        """logical sector size of a block device, else the preferred I/O
+        size of the file (a multiple of the sector size)"""
+        st: os.stat_result = os.fstat(fd)
+        if stat.S_ISBLK(st.st_mode):
+            try:
+                return struct.unpack("i", fcntl.ioctl(
+                    fd, cls.BLKSSZGET, struct.pack("i", 0)))[0]
+            except OSError:
+                pass
+        return max(st.st_blksize, 512)
+
+    def __buffered(self) -> None:
+        """fall back to normal reads"""
+        fd: int = os.open(self.__device, os.O_RDONLY)
+        os.close(self.__fd)
+        self.__fd = fd
+        self.__direct = False
+
+    def close(self) -> None:
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+    def read(self, offset: int, length: int
+             ) -> Generator[memoryview, Any, None]:
+        """read length bytes from aligned offset, the last chunk is padded
+        to alignment, each chunk is valid until the next one is read"""
+        alignment: int = self.__alignment
+        assert offset % alignment == 0, f"offset {offset} not aligned to {alignment}"  # noqa:E501
+        length = -(-length // alignment) * alignment
+        buffer: mmap.mmap = self.__pool.acquire()
+        try:
+            view: memoryview = memoryview(buffer)
+            try:
+                head: int = offset % self.__sector if self.__direct else 0
+                position: int = offset - head
+                while length > 0:
+                    size: int = min(head + length, len(view))
+                    if self.__direct:  # whole sectors
+                        size = -(-size // self.__sector) * self.__sector
+                    try:
+                        nbytes: int = os.preadv(self.__fd, [view[:size]],
+                                                position)
+                    except OSError as error:
+                        if error.errno != errno.EINVAL or not self.__direct:
+                            raise
+                        self.__buffered()  # alignment not accepted
+                        position += head
+                        head = 0
+                        continue
+                    if nbytes <= head:
+                        raise OSError(errno.EIO, f"short read at offset {position}")  # noqa:E501
+                    if not self.__direct:
+                        os.posix_fadvise(self.__fd, position, nbytes,
+                                         os.POSIX_FADV_DONTNEED)
+                    end: int = min(nbytes, head + length)
+                    yield view[head:end]
+                    position += nbytes
+                    length -= end - head
+                    head = 0
+            finally:
+                view.release()
+        finally:
+            self.__pool.release(buffer)
@@ -0,0 +1,160 @@
+# coding:utf-8
+
+import bisect
+import errno
+import fcntl
+import os
+import struct
+from typing import Any
+from typing import BinaryIO
+from typing import Dict
+from typing import Generator
+from typing import List
+from typing import Tuple
+
+# linux/fs.h: _IOW(0x94, 13, struct file_clone_range)
+FICLONERANGE: int = 0x4020940d
+
+
+def clone_range(src_fd: int, src_offset: int, length: int,
+                dst_fd: int, dst_offset: int) -> None:
+    """share length bytes of src at dst, offsets and length block aligned"""
+    # struct file_clone_range: src_fd, src_offset, src_length, dest_offset
+    args: bytes = struct.pack("qQQQ", src_fd, src_offset, length, dst_offset)
+    fcntl.ioctl(dst_fd, FICLONERANGE, args)
+
+
+def copy_range(src_fd: int, src_offset: int, length: int,
+               dst_fd: int, dst_offset: int, bufsize: int = 1 << 20) -> None:
+    """copy in kernel if possible, else with pread and pwrite"""
+    kernel: bool = hasattr(os, "copy_file_range")
+    while length > 0:
+        size: int = 0
+        if kernel:
+            try:
+                size = os.copy_file_range(src_fd, dst_fd, length,
+                                          src_offset, dst_offset)
+            except OSError:  # e.g. ENOSYS, EXDEV, EINVAL, FUSE or NFS
+                kernel = False
+                continue
+        else:
+            data: bytes = os.pread(src_fd, min(length, bufsize), src_offset)
+            size = os.pwrite(dst_fd, data, dst_offset) if data else 0
+        if size <= 0:
+            raise OSError(errno.EIO, f"short copy at offset {src_offset}")
+        src_offset += size
+        dst_offset += size
+        length -= size
+
+
+class xfs_shared_extents(object):
+    """device block ranges already rescued, for shared (reflink) extents
+
+    Every range maps [startblock, endblock) of the device to the rescued
+    target file and the byte offset in it. Ranges are kept disjoint, an
+    added range is trimmed to the blocks not indexed yet. A range is
+    filed under every chunk of CHUNK blocks it overlaps, so adding costs
+    no more than reading the range and a lookup only searches the chunks
+    of the blocks looked up.
+    """
+
+    CHUNK_SHIFT: int = 12
+
+    def __init__(self, blocksize: int) -> None:
+        self.__blocksize: int = blocksize
+        # chunk: starts and (startblock, endblock, target, offset, nbytes)
+        # of the ranges overlapping the chunk, both sorted by startblock
+        self.__chunks: Dict[int, Tuple[List[int], List[Tuple[int, int, str, int, int]]]] = {}  # noqa:E501
+        self.__clone: bool = True
+        self.__cloned: int = 0
+        self.__copied: int = 0
+
+    @property
+    def blocksize(self) -> int:
+        return self.__blocksize
+
+    @property
+    def cloned(self) -> int:
+        """bytes cloned on target"""
+        return self.__cloned
+
+    @property
+    def copied(self) -> int:
+        """bytes copied from rescued files"""
+        return self.__copied
+
+    def add(self, startblock: int, endblock: int, target: str, offset: int,
+            nbytes: int) -> None:
+        """nbytes of target at offset hold device blocks [start, end)"""
+        block: int = startblock
+        gaps: List[Tuple[int, int]] = []
+        for start, end, _, _, _ in self.lookup(startblock, endblock, True):
+            if start > block:
+                gaps.append((block, start))
+            block = end
+        if block < endblock:
+            gaps.append((block, endblock))
+        shift: int = self.CHUNK_SHIFT
+        for start, end in gaps:
+            skip: int = (start - startblock) * self.blocksize
+            if skip >= nbytes:
+                break
+            item: Tuple[int, int, str, int, int] =\
+                (start, end, target, offset + skip, nbytes - skip)
+            for chunk in range(start >> shift, ((end - 1) >> shift) + 1):
+                starts, ranges = self.__chunks.setdefault(chunk, ([], []))
+                index: int = bisect.bisect_left(starts, start)
+                starts.insert(index, start)
+                ranges.insert(index, item)
+
+    def lookup(self, startblock: int, endblock: int, partial: bool = False
+               ) -> Generator[Tuple[int, int, str, int, int], Any, None]:
+        """rescued parts of device blocks [startblock, endblock)
+
+        Yields (start, end, target, offset, nbytes) clipped to the range
+        in ascending order, nbytes is what target holds from offset on.
+        Parts whose target ends before them are skipped unless partial.
+        """
+        shift: int = self.CHUNK_SHIFT
+        for chunk in range(startblock >> shift,
+                           ((endblock - 1) >> shift) + 1):
+            if chunk not in self.__chunks:
+                continue
+            starts, ranges = self.__chunks[chunk]
+            # a range in an earlier chunk was yielded there already
+            first: int = max(startblock, chunk << shift)
+            index: int = max(bisect.bisect_right(starts, first) - 1, 0)
+            for index in range(index, len(ranges)):
+                start, end, target, offset, nbytes = ranges[index]
+                if start >= endblock:
+                    return
+                if end <= first or (start < first and first > startblock):
+                    continue
+                skip: int = max(startblock - start, 0) * self.blocksize
+                if skip >= nbytes and not partial:
+                    continue
+                yield (max(start, startblock), min(end, endblock), target,
+                       offset + skip, nbytes - skip)
+
+    def copy(self, target: str, offset: int, length: int,
+             stream: BinaryIO, position: int) -> None:
+        """write length bytes of rescued target at offset to stream"""
+        stream.flush()
+        with open(target, "rb") as rhdl:
+            src_fd: int = rhdl.fileno()
+            dst_fd: int = stream.fileno()
+            aligned: int = length - length % self.blocksize
+            if self.__clone and aligned > 0:
+                try:
+                    clone_range(src_fd, offset, aligned, dst_fd, position)
+                    self.__cloned += aligned
+                    offset += aligned
+                    position += aligned
+                    length -= aligned
+                except OSError as error:
+                    if error.errno in (errno.EOPNOTSUPP, errno.ENOTTY,
+                                       errno.EXDEV, errno.EBADF):
+                        self.__clone = False  # target does not support
+            copy_range(src_fd, offset, length, dst_fd, position)
+            self.__copied += length
+        stream.seek(position + length, os.SEEK_SET)
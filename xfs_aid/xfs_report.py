@@ -0,0 +1,532 @@
+# coding:utf-8
+
+from array import array
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Deque
+from typing import Dict
+from typing import Generator
+from typing import Iterable
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+from .xfs_aidkit import xfs_scan
+from .xfs_debug import xfs_blockmap
+
+try:
+    import numpy
+except ImportError:  # optional, fall back to pure Python over arrays
+    numpy = None  # type: ignore
+
+
+class xfs_extent_columns(object):
+    """all extent maps as compact columns, one row per extent
+
+    Per extent: file (row of the file), agno, agbno, count and flag. Per
+    file: ino and size (-1 if its inode was unreadable).
+    """
+
+    def __init__(self) -> None:
+        self.__file: array = array("I")
+        self.__agno: array = array("I")
+        self.__agbno: array = array("I")
+        self.__count: array = array("I")
+        self.__flag: array = array("B")
+        self.__ino: array = array("Q")
+        self.__size: array = array("q")
+
+    @property
+    def file(self) -> array:
+        return self.__file
+
+    @property
+    def agno(self) -> array:
+        return self.__agno
+
+    @property
+    def agbno(self) -> array:
+        return self.__agbno
+
+    @property
+    def count(self) -> array:
+        return self.__count
+
+    @property
+    def flag(self) -> array:
+        return self.__flag
+
+    @property
+    def ino(self) -> array:
+        return self.__ino
+
+    @property
+    def size(self) -> array:
+        return self.__size
+
+    @property
+    def files(self) -> int:
+        return len(self.__ino)
+
+    @property
+    def extents(self) -> int:
+        return len(self.__file)
+
+    def add(self, ino: int, size: int, extents: Iterable[xfs_blockmap]
+            ) -> None:
+        row: int = len(self.__ino)
+        self.__ino.append(ino)
+        self.__size.append(size)
+        for extent in extents:
+            self.__file.append(row)
+            self.__agno.append(extent.agno)
+            self.__agbno.append(extent.agbno)
+            self.__count.append(extent.count)
+            self.__flag.append(extent.flag)
+
+    @classmethod
+    def gather(cls, scanner: xfs_scan, batch: int = 256
+               ) -> "xfs_extent_columns":
+        """block maps of all regular files, batch inodes per xfs_db run"""
+
+        def batches() -> Generator[List[int], Any, None]:
+            inodes: List[int] = []
+            for obj in scanner.objects:
+                if obj.is_file:
+                    inodes.append(obj.ino)
+                    if len(inodes) >= batch:
+                        yield inodes
+                        inodes = []
+            if inodes:
+                yield inodes
+
+        def bmaps(inodes: Sequence[int]
+                  ) -> List[Tuple[int, int, List[xfs_blockmap]]]:
+            return list(scanner.debug.bmaps(inodes))
+
+        def add(future: Future) -> None:
+            for ino, size, extents in future.result():
+                columns.add(ino=ino, size=size, extents=extents)
+
+        columns: xfs_extent_columns = cls()
+        jobs: int = max(1, scanner.jobs)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            pending: Deque[Future] = deque()
+            for inodes in batches():  # bounded batches in flight
+                pending.append(executor.submit(bmaps, inodes))
+                if len(pending) >= jobs * 2:
+                    add(pending.popleft())
+            while pending:
+                add(pending.popleft())
+        return columns
+
+
+class xfs_extent_report(object):
+    """fragmentation and damage analytics over extent columns
+
+    Heatmaps split every AG into bins by agbno, an extent counts in the
+    bin it starts in. Used blocks count shared (reflink) blocks once. A
+    file is damaged if its inode is unreadable, its extents hold fewer
+    blocks than its size needs or any of them lies outside the volume
+    (agno or agbno out of range). Such invalid extents are only counted.
+
+    With numpy the columns are processed in steps of CHUNK rows. Without
+    it the pure Python fallback holds several ints per extent, use it on
+    small volumes only.
+    """
+
+    CHUNK: int = 1 << 18
+
+    def __init__(self, columns: xfs_extent_columns, blocksize: int,
+                 agcount: int, agblocks: int, bins: int = 16) -> None:
+        self.__columns: xfs_extent_columns = columns
+        self.__blocksize: int = blocksize
+        self.__agcount: int = agcount
+        self.__agblocks: int = agblocks
+        self.__bins: int = bins
+        self.__result: Dict[str, Any] = self.__numpy() if numpy is not None\
+            else self.__python()
+
+    @property
+    def columns(self) -> xfs_extent_columns:
+        return self.__columns
+
+    @property
+    def bins(self) -> int:
+        return self.__bins
+
+    @property
+    def damaged(self) -> int:
+        """damaged files"""
+        return self.__result["damaged"]
+
+    @property
+    def invalid(self) -> int:
+        """extents outside the volume"""
+        return self.__result["invalid"]
+
+    @property
+    def blocks(self) -> int:
+        """blocks in all extents"""
+        return self.__result["blocks"]
+
+    @property
+    def histogram(self) -> List[int]:
+        """files by extent count buckets 0, 1, 2-3, 4-7, ..."""
+        return self.__result["histogram"]
+
+    @property
+    def ag_blocks(self) -> List[int]:
+        """used blocks per AG"""
+        return self.__result["ag_blocks"]
+
+    @property
+    def ag_extents(self) -> List[int]:
+        return self.__result["ag_extents"]
+
+    @property
+    def utilization(self) -> List[List[int]]:
+        """used blocks per AG and bin"""
+        return self.__result["utilization"]
+
+    @property
+    def damage(self) -> List[List[int]]:
+        """blocks of damaged files per AG and bin"""
+        return self.__result["damage"]
+
+    @property
+    def seek(self) -> Tuple[int, int]:
+        """seeks and blocks seeked in scan order of good files
+
+        The order xfs-rescue with the same --unordered rebuilds files in,
+        DFS by default. Completion order varies between runs.
+        """
+        return self.__result["seek"]
+
+    @property
+    def seek_sorted(self) -> Tuple[int, int]:
+        """seeks and blocks seeked if good extents are read by address"""
+        return self.__result["seek_sorted"]
+
+    @classmethod
+    def bucket_label(cls, bucket: int) -> str:
+        if bucket <= 1:
+            return str(bucket)
+        return f"{1 << (bucket - 1)}-{(1 << bucket) - 1}"
+
+    def __numpy(self) -> Dict[str, Any]:
+        """vectorized in steps of CHUNK rows, temporaries stay bounded
+
+        Columns are viewed, not copied. Per-file sums rely on the rows of
+        a file being adjacent, as add() appends them. Address order is
+        built as one row permutation (4 bytes per extent) grouped into
+        address ranges of about CHUNK / 4 extents, a step sorts whole
+        ranges only and carries the coverage and the last end across.
+        """
+        c: xfs_extent_columns = self.columns
+        nfiles: int = c.files
+        nrows: int = c.extents
+        agcount: int = self.__agcount
+        agblocks: int = self.__agblocks
+        bins: int = self.bins
+        cells: int = agcount * bins
+        chunk: int = self.CHUNK
+
+        def column(data: array, dtype: str) -> Any:
+            return numpy.frombuffer(data, dtype=dtype) if len(data) else\
+                numpy.zeros(0, dtype=dtype)
+
+        file = column(c.file, "uint32")
+        agno = column(c.agno, "uint32")
+        agbno = column(c.agbno, "uint32")
+        count = column(c.count, "uint32")
+        size = column(c.size, "int64")
+
+        def steps(total: int) -> Generator[slice, Any, None]:
+            for start in range(0, total, chunk):
+                yield slice(start, min(start + chunk, total))
+
+        def valid(rows: Any) -> Any:
+            return (agno[rows] < agcount) & (agbno[rows] < agblocks)
+
+        def gaps(address: Any, ends: Any, last: int) -> Tuple[int, int]:
+            """seeks from the previous end (last, -1 for none) on"""
+            gap = numpy.abs(address - numpy.concatenate(([last], ends[:-1])))
+            if last < 0:
+                gap = gap[1:]
+            return int(numpy.count_nonzero(gap)), int(gap.sum())
+
+        nextents = numpy.zeros(nfiles, dtype="uint32")
+        blocks = numpy.zeros(nfiles, dtype="int64")
+        damaged = numpy.zeros(nfiles, dtype=bool)
+        invalid: int = 0
+        nblocks: int = 0
+        for rows in steps(nrows):
+            lo: int = int(file[rows].min())
+            n: int = int(file[rows].max()) + 1 - lo
+            owner = file[rows] - lo
+            nextents[lo:lo + n] += numpy.bincount(
+                owner, minlength=n).astype("uint32")
+            blocks[lo:lo + n] += numpy.bincount(
+                owner, weights=count[rows], minlength=n).astype("int64")
+            bad = ~valid(rows)
+            invalid += int(numpy.count_nonzero(bad))
+            damaged[lo:lo + n] |= numpy.bincount(owner[bad], minlength=n) > 0
+            nblocks += int(count[rows].sum(dtype="int64"))
+            del owner, bad
+
+        histogram = numpy.zeros(1, dtype="int64")
+        for rows in steps(nfiles):
+            damaged[rows] |= (size[rows] < 0) |\
+                (blocks[rows] * self.__blocksize < size[rows])
+            buckets = numpy.zeros(rows.stop - rows.start, dtype="int64")
+            nonzero = nextents[rows] > 0
+            buckets[nonzero] = numpy.floor(
+                numpy.log2(nextents[rows][nonzero])) + 1
+            step = numpy.bincount(buckets)
+            if len(step) > len(histogram):
+                histogram = numpy.concatenate(
+                    (histogram, numpy.zeros(len(step) - len(histogram),
+                                            dtype="int64")))
+            histogram[:len(step)] += step
+            del buckets, nonzero
+        del nextents, blocks
+
+        # good extents in scan (row) order
+        seeks: int = 0
+        distance: int = 0
+        last: int = -1
+        for rows in steps(nrows):
+            good = valid(rows)
+            good &= ~damaged[file[rows]]
+            address = agno[rows][good].astype("int64") * agblocks +\
+                agbno[rows][good]
+            if len(address):
+                ends = address + count[rows][good]
+                step_seeks, step_distance = gaps(address, ends, last)
+                seeks += step_seeks
+                distance += step_distance
+                last = int(ends[-1])
+                del ends
+            del good, address
+
+        # group valid rows by address range, stable so ties keep row order
+        target: int = max(1, -(-4 * nrows // (chunk * max(1, agcount))))
+        shift: int = max(0, (agblocks - 1).bit_length() -
+                         (target - 1).bit_length())
+        per_ag: int = ((agblocks - 1) >> shift) + 1
+        ranges: int = agcount * per_ag
+
+        def key(rows: Any) -> Any:
+            keys = agno[rows].astype("int64") * per_ag +\
+                (agbno[rows] >> shift)
+            keys[~valid(rows)] = ranges  # invalid rows last, never read
+            # small keys take numpy's radix sort
+            return keys.astype("uint16") if ranges < 1 << 16 else keys
+
+        sizes = numpy.zeros(ranges + 1, dtype="int64")
+        for rows in steps(nrows):
+            sizes += numpy.bincount(key(rows), minlength=ranges + 1)
+        bounds = numpy.cumsum(sizes)
+        fill = bounds - sizes
+        order = numpy.empty(nrows, dtype="uint32" if nrows < 1 << 32
+                            else "uint64")
+        for rows in steps(nrows):
+            keys = key(rows)
+            rank = numpy.argsort(keys, kind="stable")
+            keys = keys[rank]
+            step = numpy.bincount(keys, minlength=ranges + 1)
+            first = numpy.cumsum(step) - step
+            order[fill[keys] + numpy.arange(len(keys)) - first[keys]] =\
+                rank + rows.start
+            fill += step
+            del keys, rank, step, first
+        del sizes, fill
+
+        # blocks not covered by any extent at a lower address, so shared
+        # blocks are used once: running maximum of the sorted extent ends
+        ag_blocks = numpy.zeros(agcount, dtype="int64")
+        ag_extents = numpy.zeros(agcount, dtype="int64")
+        utilization = numpy.zeros(cells, dtype="int64")
+        damage = numpy.zeros(cells, dtype="int64")
+        covered: int = 0
+        best_seeks: int = 0
+        best_distance: int = 0
+        last = -1
+        bounds = bounds[:ranges]
+        total: int = int(bounds[-1]) if ranges else 0
+        start: int = 0
+        while start < total:
+            # whole ranges up to chunk rows, at least one range
+            index: int = int(numpy.searchsorted(bounds, start + chunk,
+                                                side="right")) - 1
+            stop: int = int(bounds[index]) if index >= 0 else start
+            if stop <= start:
+                stop = int(bounds[numpy.searchsorted(bounds, start,
+                                                     side="right")])
+            rows = order[start:stop]
+            start = stop
+            starts = agno[rows].astype("int64") * agblocks + agbno[rows]
+            lowest: int = int(starts.min())
+            if int(starts.max()) - lowest < (1 << 62) // len(starts):
+                # unique keys, so the faster sort keeps row order on ties
+                rank = numpy.argsort((starts - lowest) * len(starts) +
+                                     numpy.arange(len(starts)))
+            else:
+                rank = numpy.argsort(starts, kind="stable")
+            rows, starts = rows[rank], starts[rank]
+            ags = starts // agblocks
+            offset = starts - ags * agblocks
+            length = count[rows].astype("int64")
+            bad = damaged[file[rows]]
+            del rows, rank
+            ends = starts + length
+            previous = numpy.maximum.accumulate(ends)
+            previous = numpy.maximum(
+                numpy.concatenate(([covered], previous[:-1])), covered)
+            covered = max(covered, int(ends.max()))
+            unique = numpy.clip(ends - numpy.maximum(starts, previous),
+                                0, None)
+            del previous
+            cell = ags * bins + numpy.minimum(offset * bins // agblocks,
+                                              bins - 1)
+            ag_blocks += numpy.bincount(ags, weights=unique,
+                                        minlength=agcount).astype("int64")
+            ag_extents += numpy.bincount(ags, minlength=agcount)
+            utilization += numpy.bincount(cell, weights=unique,
+                                          minlength=cells).astype("int64")
+            damage += numpy.bincount(cell[bad], weights=length[bad],
+                                     minlength=cells).astype("int64")
+            good = ~bad
+            if numpy.any(good):
+                step_seeks, step_distance = gaps(starts[good], ends[good],
+                                                 last)
+                best_seeks += step_seeks
+                best_distance += step_distance
+                last = int(ends[good][-1])
+            del ags, offset, starts, length, bad, ends, unique, cell, good
+        del order, bounds
+
+        return {
+            "damaged": int(numpy.count_nonzero(damaged)),
+            "invalid": invalid,
+            "blocks": nblocks,
+            "histogram": histogram.tolist(),
+            "ag_blocks": ag_blocks.tolist(),
+            "ag_extents": ag_extents.tolist(),
+            "utilization": utilization.reshape(-1, bins).tolist(),
+            "damage": damage.reshape(-1, bins).tolist(),
+            "seek": (seeks, distance),
+            "seek_sorted": (best_seeks, best_distance),
+        }
+
+    def __python(self) -> Dict[str, Any]:
+        """small volumes only, lists of ints per extent and sorted copies"""
+        c: xfs_extent_columns = self.columns
+        agcount: int = self.__agcount
+        bins: int = self.bins
+
+        nextents: List[int] = [0] * c.files
+        blocks: List[int] = [0] * c.files
+        invalid: List[int] = [0] * c.files
+        rows: List[int] = []  # extents inside the volume
+        for row, (file, agno, agbno, count) in enumerate(
+                zip(c.file, c.agno, c.agbno, c.count)):
+            nextents[file] += 1
+            blocks[file] += count
+            if agno < agcount and agbno < self.__agblocks:
+                rows.append(row)
+            else:
+                invalid[file] += 1
+        damaged: List[bool] = [size < 0 or nblock * self.__blocksize < size
+                               or bad > 0 for size, nblock, bad
+                               in zip(c.size, blocks, invalid)]
+
+        histogram: List[int] = [0]
+        for n in nextents:
+            bucket: int = n.bit_length()
+            if bucket >= len(histogram):
+                histogram.extend([0] * (bucket + 1 - len(histogram)))
+            histogram[bucket] += 1
+
+        ag_blocks: List[int] = [0] * agcount
+        ag_extents: List[int] = [0] * agcount
+        utilization: List[List[int]] = [[0] * bins for _ in range(agcount)]
+        damage: List[List[int]] = [[0] * bins for _ in range(agcount)]
+        # blocks not covered by any extent at a lower address
+        unique: List[int] = [0] * c.extents
+        covered: int = 0
+        for row in sorted(rows, key=lambda row:
+                          c.agno[row] * self.__agblocks + c.agbno[row]):
+            start: int = c.agno[row] * self.__agblocks + c.agbno[row]
+            end: int = start + c.count[row]
+            unique[row] = max(end - max(start, covered), 0)
+            covered = max(covered, end)
+
+        good: List[Tuple[int, int]] = []  # (address, count)
+        for row in rows:
+            file: int = c.file[row]
+            agno: int = c.agno[row]
+            agbno: int = c.agbno[row]
+            count: int = c.count[row]
+            used: int = unique[row]
+            cell: int = min(agbno * bins // self.__agblocks, bins - 1)
+            ag_blocks[agno] += used
+            ag_extents[agno] += 1
+            utilization[agno][cell] += used
+            if damaged[file]:
+                damage[agno][cell] += count
+            else:
+                good.append((agno * self.__agblocks + agbno, count))
+
+        def seek(order: List[Tuple[int, int]]) -> Tuple[int, int]:
+            seeks: int = 0
+            distance: int = 0
+            for (prev, length), (address, _) in zip(order, order[1:]):
+                gap: int = abs(address - (prev + length))
+                if gap:
+                    seeks += 1
+                    distance += gap
+            return seeks, distance
+
+        return {
+            "damaged": sum(damaged),
+            "invalid": sum(invalid),
+            "blocks": sum(c.count),
+            "histogram": histogram,
+            "ag_blocks": ag_blocks,
+            "ag_extents": ag_extents,
+            "utilization": utilization,
+            "damage": damage,
+            "seek": seek(good),
+            "seek_sorted": seek(sorted(good, key=lambda item: item[0])),
+        }
+
+    @classmethod
+    def heat(cls, row: Sequence[int], peak: int) -> str:
+        """one character per bin, scaled to peak"""
+        shades: str = " .:-=+*#%@"
+        if peak <= 0:
+            return " " * len(row)
+        return "".join(shades[min(value * (len(shades) - 1) // peak + (1 if value else 0), len(shades) - 1)] for value in row)  # noqa:E501
+
+    def show(self) -> Generator[str, Any, None]:
+        c: xfs_extent_columns = self.columns
+        yield f"{c.files} files, {c.extents} extents, {self.blocks} blocks, {self.damaged} damaged files"  # noqa:E501
+        if self.invalid:
+            yield f"{self.invalid} extents outside the volume (agno or agbno out of range)"  # noqa:E501
+        yield "extents per file:"
+        for bucket, files in enumerate(self.histogram):
+            if files:
+                yield f"  {self.bucket_label(bucket):>15} {files}"
+        yield f"per AG: agno used% extents |utilization| |damage| ({self.bins} bins)"  # noqa:E501
+        peak_used: int = max((max(row) for row in self.utilization), default=0)  # noqa:E501
+        peak_bad: int = max((max(row) for row in self.damage), default=0)
+        for agno in range(self.__agcount):
+            used: float = self.ag_blocks[agno] * 100 / self.__agblocks
+            yield f"  {agno:>6} {used:6.2f}% {self.ag_extents[agno]:>10} |{self.heat(self.utilization[agno], peak_used)}| |{self.heat(self.damage[agno], peak_bad)}|"  # noqa:E501
+        seeks, distance = self.seek
+        best_seeks, best_distance = self.seek_sorted
+        yield f"rescue seek cost: {seeks} seeks over {distance} blocks (scan order), {best_seeks} seeks over {best_distance} blocks (address order)"  # noqa:E501
@@ -1,8 +1,14 @@
 # coding:utf-8
 
 import os
+import re
+from typing import Any
 from typing import Dict
-from typing import List
+from typing import ItemsView
+from typing import Iterator
+from typing import KeysView
+from typing import Optional
+from typing import ValuesView
 
 
 def is_mount_device(device: str) -> bool:
@@ -17,16 +23,78 @@ def is_empty_directory(dir: str) -> bool:
 
 
 class xfs_kv(Dict[str, str]):
+    """key = value lines, a value is extracted when first looked up
+
+    Enumerating (iter, len, keys, values, items) parses all lines once.
+    """
+
+    PATTERNS: Dict[str, "re.Pattern[str]"] = {}
 
     def __init__(self, text: str) -> None:
         super().__init__()
         self.__text: str = text
-        for item in text.splitlines():
-            key_value: List[str] = [i.strip() for i in item.split("=", 1)]
-            if len(key_value) == 2:
-                key, value = key_value
-                self[key] = value
+        self.__loaded: bool = False
 
     @property
     def text(self) -> str:
         return self.__text
+
+    @classmethod
+    def pattern(cls, key: str) -> "re.Pattern[str]":
+        if key not in cls.PATTERNS:
+            cls.PATTERNS[key] = re.compile(
+                rf"^[ \t]*{re.escape(key)}[ \t]*=(?P<value>[^\n]*)$", re.M)
+        return cls.PATTERNS[key]
+
+    def __load(self) -> None:
+        if not self.__loaded:
+            # key = value, split at the first "=" and strip both, the first
+            # line of a key wins as in lookups
+            for line in self.text.splitlines():
+                key, sep, value = line.partition("=")
+                if sep:
+                    super().setdefault(key.strip(), value.strip())
+            self.__loaded = True
+
+    def __missing__(self, key: str) -> str:
+        if self.__loaded:
+            raise KeyError(key)
+        match: Optional[re.Match[str]] = self.pattern(key).search(self.text)
+        if match is None:
+            raise KeyError(key)
+        value: str = match.group("value").strip()
+        self[key] = value
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        try:
+            self[key]  # type: ignore
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        self.__load()
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        self.__load()
+        return super().__len__()
+
+    def get(self, key: str, default: Any = None) -> Any:  # type: ignore
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> KeysView[str]:  # type: ignore
+        self.__load()
+        return super().keys()
+
+    def values(self) -> ValuesView[str]:  # type: ignore
+        self.__load()
+        return super().values()
+
+    def items(self) -> ItemsView[str, str]:  # type: ignore
+        self.__load()
+        return super().items()
@@ -0,0 +1,231 @@
+# coding:utf-8
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Generator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .exception import XfsCmdException
+from .xfs_debug import xfs_content
+
+
+class xfs_walk_node(object):
+    """pending directory"""
+
+    PENDING: int = 0
+    RUNNING: int = 1
+    DONE: int = 2
+
+    def __init__(self, content: Optional[xfs_content]) -> None:
+        self.__content: Optional[xfs_content] = content
+        self.state: int = self.PENDING
+        self.entries: List[Tuple[xfs_content, Optional["xfs_walk_node"]]] = []  # noqa:E501
+        self.error: Optional[BaseException] = None
+
+    @property
+    def content(self) -> Optional[xfs_content]:
+        """directory, None is root"""
+        return self.__content
+
+
+class xfs_walker(object):
+    """concurrent work-stealing directory traversal
+
+    Every worker pops pending directories from the tail of its own deque
+    (depth first) and steals from the head of other workers' deques
+    (shallowest, i.e. largest subtrees) when it runs dry. At most backlog
+    listed but not yet consumed directories are buffered, a directory is
+    released as soon as its entries are consumed.
+
+    With ordered=True objects come out in the same DFS order as a serial
+    traversal, directories after their contents, and the consumer lists
+    a directory itself if no worker has taken it yet. Otherwise objects
+    come out in completion order, each directory after its own listing.
+    """
+
+    def __init__(self, listdir: Callable[[Optional[xfs_content], List[xfs_content]], None],  # noqa:E501
+                 jobs: int = 8, ordered: bool = True,
+                 backlog: Optional[int] = None) -> None:
+        self.__listdir = listdir
+        self.__jobs: int = max(1, jobs)
+        self.__ordered: bool = ordered
+        self.__backlog: int = backlog or self.__jobs * 16
+        self.__cond: threading.Condition = threading.Condition()
+        self.__deques: List[Deque[xfs_walk_node]] = []
+        self.__done: Deque[xfs_walk_node] = deque()
+        self.__outstanding: int = 0
+        self.__buffered: int = 0
+        self.__stop: bool = False
+
+    @property
+    def jobs(self) -> int:
+        return self.__jobs
+
+    @property
+    def ordered(self) -> bool:
+        return self.__ordered
+
+    def __list(self, node: xfs_walk_node) -> List[xfs_walk_node]:
+        """list a directory, failed listing marks the directory damaged"""
+        entries: List[xfs_content] = []
+        try:
+            self.__listdir(node.content, entries)
+        except XfsCmdException:
+            if node.content is not None:
+                node.content.damaged = True
+        except BaseException as error:  # pylint: disable=broad-except
+            node.error = error
+        children: List[xfs_walk_node] = []
+        for entry in entries:
+            child: Optional[xfs_walk_node] = None
+            if entry.is_dir:
+                child = xfs_walk_node(entry)
+                children.append(child)
+            node.entries.append((entry, child))
+        return children
+
+    def __finish(self, node: xfs_walk_node, local: Deque[xfs_walk_node],
+                 children: List[xfs_walk_node]) -> None:
+        # called with condition held
+        local.extend(reversed(children))  # first child on the tail
+        self.__outstanding += len(children) - 1
+        self.__buffered += 1
+        node.state = node.DONE
+        if not self.__ordered:
+            self.__done.append(node)
+        if node.error is not None:
+            self.__stop = True
+        self.__cond.notify_all()
+
+    def __take(self, index: int) -> Optional[xfs_walk_node]:
+        # called with condition held
+        local: Deque[xfs_walk_node] = self.__deques[index]
+        while local:
+            node: xfs_walk_node = local.pop()
+            if node.state == node.PENDING:
+                return node
+        for offset in range(1, len(self.__deques)):
+            victim = self.__deques[(index + offset) % len(self.__deques)]
+            while victim:
+                node = victim.popleft()
+                if node.state == node.PENDING:
+                    return node
+        return None
+
+    def __trim(self) -> None:
+        # called with condition held, drop directories taken by the
+        # consumer from both ends of every deque so they can be released
+        for local in self.__deques:
+            while local and local[-1].state != xfs_walk_node.PENDING:
+                local.pop()
+            while local and local[0].state != xfs_walk_node.PENDING:
+                local.popleft()
+
+    def __worker(self, index: int) -> None:
+        local: Deque[xfs_walk_node] = self.__deques[index]
+        while True:
+            with self.__cond:
+                while True:
+                    if self.__stop or self.__outstanding == 0:
+                        return
+                    if self.__buffered < self.__backlog:
+                        node: Optional[xfs_walk_node] = self.__take(index)
+                        if node is not None:
+                            node.state = node.RUNNING
+                            break
+                    self.__cond.wait()
+            children: List[xfs_walk_node] = self.__list(node)
+            with self.__cond:
+                self.__finish(node, local, children)
+
+    def __wait(self, node: xfs_walk_node) -> None:
+        """wait for a directory listing, list it here if still pending"""
+        with self.__cond:
+            if node.state == node.PENDING:
+                node.state = node.RUNNING
+                self.__trim()
+                run: bool = True
+            else:
+                run = False
+                while node.state != node.DONE:
+                    self.__cond.wait()
+        if run:
+            children: List[xfs_walk_node] = self.__list(node)
+            with self.__cond:
+                self.__finish(node, self.__deques[0], children)
+        with self.__cond:
+            self.__buffered -= 1
+            self.__cond.notify_all()
+        if node.error is not None:
+            raise node.error
+
+    @classmethod
+    def __consume(cls, node: xfs_walk_node
+                  ) -> List[Tuple[xfs_content, Optional[xfs_walk_node]]]:
+        """detach the entries of a listed directory, reversed for pop()
+        so that consumed entries and subtrees are released as we go"""
+        entries: List[Tuple[xfs_content, Optional[xfs_walk_node]]] =\
+            node.entries
+        node.entries = []
+        entries.reverse()
+        return entries
+
+    def __dfs(self, node: xfs_walk_node
+              ) -> Generator[xfs_content, Any, None]:
+        self.__wait(node)
+        entries: List[Tuple[xfs_content, Optional[xfs_walk_node]]] =\
+            self.__consume(node)
+        while entries:
+            entry, child = entries.pop()
+            if child is not None:  # deep first
+                yield from self.__dfs(child)
+            yield entry
+
+    def __completion(self) -> Generator[xfs_content, Any, None]:
+        while True:
+            with self.__cond:
+                while not self.__done and self.__outstanding > 0:
+                    self.__cond.wait()
+                if not self.__done:
+                    return
+                node: xfs_walk_node = self.__done.popleft()
+                self.__buffered -= 1
+                self.__cond.notify_all()
+            if node.error is not None:
+                raise node.error
+            entries: List[Tuple[xfs_content, Optional[xfs_walk_node]]] =\
+                self.__consume(node)
+            while entries:
+                entry, child = entries.pop()
+                if child is None:
+                    yield entry
+            if node.content is not None:
+                yield node.content
+
+    def walk(self) -> Generator[xfs_content, Any, None]:
+        """all objects, starting from root"""
+        root: xfs_walk_node = xfs_walk_node(None)
+        self.__deques = [deque() for _ in range(self.jobs)]
+        self.__deques[0].append(root)
+        self.__done.clear()
+        self.__outstanding = 1
+        self.__buffered = 0
+        self.__stop = False
+        objects: Generator[xfs_content, Any, None] = self.__dfs(root)\
+            if self.ordered else self.__completion()
+        del root  # listed directories are released once consumed
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for index in range(self.jobs):
+                executor.submit(self.__worker, index)
+            try:
+                yield from objects
+            finally:
+                with self.__cond:
+                    self.__stop = True
+                    self.__cond.notify_all()